@@ -1,117 +1,67 @@
 # pip imports
 import json
 import os
-import socketserver
 import subprocess
 import threading
 from flask import Flask, request, jsonify, send_file
 from flask_cors import CORS
 from threading import Event
-import time
-import eventlet
 from PIL import Image
-from io import BytesIO
-import cv2
 import websockets
 from werkzeug.utils import secure_filename
 from flask_sockets import Sockets
 import asyncio
 
 # local imports
-from utils.jumbotron import Jumbotron
+from utils.jumbotron import Jumbotron, array_to_matrix
 from utils.config import Config
-from utils.httpDecorator import CustomHTTPRequestHandler, route 
+from utils.calibration import calibrate
+from utils.preview import SUBPROTOCOLS
+from utils.broadcast import PreviewHub
+from utils.catalog import SaveCatalog
+from utils import saveformat
+from utils.persistence import PersistenceWorker
+from utils.videocache import get_video_cache, remove_video_cache
+from utils.playback import VideoPlayer
+from utils.drawing import DrawError, apply_operations, parse_operations
+from utils.thumbnails import ThumbnailError, is_fresh, remove_thumbnail, thumbnail_path, validators, write_thumbnail
+from utils.httpDecorator import CustomHTTPRequestHandler, PooledHTTPServer, route
 
 try:
     # Setup
     temp_filename = None
     thread_started = False
     thread_stop_event = Event()
-    video_is_playing = True
+    video_is_playing = False
     app = Flask(__name__)
     CORS(app)
     sockets = Sockets(app)
-    clients = set()
-    jumbotron_updater_thread = None
+    preview_hub = PreviewHub()
+    saves_catalog = SaveCatalog()
+    state_writer = PersistenceWorker(Config.STATE_FILE)
+    video_player = VideoPlayer()
 
     # region Helper Methods
     def save_state(state):
-        with open(Config.STATE_FILE, 'w') as file:
-            json.dump(state, file)
+        # Written by the background worker, requests never wait on the SD card
+        state_writer.submit(state)
+
+    def persist_painted_frame(version):
+        # Framebuffer listener: painted edits become the boot state too, video frames aren't worth keeping
+        if not video_is_playing:
+            state_writer.submit(lambda: {'type': 'image', 'content': Config.MATRIX.get_array()})
 
     def load_state():
-        if os.path.exists(Config.STATE_FILE):
-            with open(Config.STATE_FILE, 'r') as file:
-                return json.load(file)
+        # Fall back to the state file of older versions, read as legacy JSON
+        for path in (Config.STATE_FILE, Config.LEGACY_STATE_FILE):
+            if os.path.exists(path):
+                try:
+                    return saveformat.read(path)
+                except (OSError, saveformat.SaveFormatError) as e:
+                    # A damaged state file just means starting without the last state
+                    Config.LOGGER.error("Could not read last state from %s: %s", path, str(e))
         return None
 
-    def convert_matrix_to_image(matrix):
-        image = Image.new("RGB", (Config.COLUMNS, Config.ROWS))
-        for row in range(Config.ROWS):
-            for column in range(Config.COLUMNS):
-                pixel = matrix[row][column]
-                r, g, b = pixel['r'], pixel['g'], pixel['b']
-                image.putpixel((column, row), (r, g, b))
-        return image
-
-    async def jumbotron_updater(websocket):
-        Config.LOGGER.info("Client connected")
-        while not thread_stop_event.is_set():
-            if (Config.MATRIX is not None):
-                try:
-                    message = json.dumps({
-                        'data': Config.MATRIX.get2DArrayRepresentation(),
-                        'timestamp': time.time_ns()
-                    })
-                    await websocket.send(message)
-                except Exception as e:
-                    await websocket.close() 
-                    Config.LOGGER.info("Client disconnected")
-                    break
-                await asyncio.sleep(1/Config.UPDATES_PER_SECOND) 
-
-    def video_playback_thread():
-        try:
-            video = cv2.VideoCapture(temp_filename)
-
-            if not video.isOpened():
-                Config.LOGGER.warning("Could not open video")
-                return
-
-            start_time = time.time()
-            frames_processed = 0
-
-            while video_is_playing:
-                ret, frame = video.read()
-                if not ret:
-                    video.set(cv2.CAP_PROP_POS_FRAMES, 0)
-                    start_time = time.time()
-                    frames_processed = 0
-                    continue
-
-                expected_time = start_time + (frames_processed / Config.UPDATES_PER_SECOND)
-                current_time = time.time()
-                if current_time < expected_time:
-                    time.sleep(expected_time - current_time)
-                elif current_time > expected_time + (1 / Config.UPDATES_PER_SECOND):
-                    frames_processed += 1
-                    continue
-
-                # Get the current brightness setting
-                current_brightness = Config.MATRIX.getBrightness()
-
-                # Convert the frame to an image and adjust brightness
-                image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-                matrix_representation = Jumbotron.convert_image_to_matrix(image, current_brightness)
-
-                # Update the matrix with the new frame
-                Config.MATRIX.update_from_matrix_array(matrix_representation)
-                frames_processed += 1
-
-            video.release()
-        except Exception as e:
-            Config.LOGGER.error("Error in video playback thread: %s", str(e))
-            
     #endregion
     def json_response(data, status=200):
         return json.dumps(data), status
@@ -138,7 +88,7 @@ try:
             "Updating pixel at row: %d, column: %d to r: %d, g: %d, b: %d, brightness: %d",
             row, column, r, g, b, brightness
         )
-        Config.MATRIX.updatePixel(int(row), int(column), int(r), int(g), int(b), int(brightness))
+        Config.MATRIX.updatePixel(row, column, r, g, b, brightness)
         return json_response({"success": True})
 
     @route('/jumbotron/row/<int:row>/<int:r>/<int:g>/<int:b>/<int:brightness>', method='GET')
@@ -147,7 +97,7 @@ try:
             "Updating row: %d to r: %d, g: %d, b: %d, brightness: %d",
             row, r, g, b, brightness
         )
-        Config.MATRIX.updateRow(int(row), int(r), int(g), int(b), int(brightness))
+        Config.MATRIX.updateRow(row, r, g, b, brightness)
         return json_response({"success": True})
 
     @route('/jumbotron/column/<int:column>/<int:r>/<int:g>/<int:b>/<int:brightness>', method='GET')
@@ -156,7 +106,7 @@ try:
             "Updating column: %d to r: %d, g: %d, b: %d, brightness: %d",
             column, r, g, b, brightness
         )
-        Config.MATRIX.updateColumn(int(column), int(r), int(g), int(b), int(brightness))
+        Config.MATRIX.updateColumn(column, r, g, b, brightness)
         return json_response({"success": True})
 
     @route('/jumbotron/all/<int:r>/<int:g>/<int:b>/<int:brightness>', method='GET')
@@ -165,19 +115,34 @@ try:
             "Updating all pixels to r: %d, g: %d, b: %d, brightness: %d",
             r, g, b, brightness
         )
-        Config.MATRIX.updateAll(int(r), int(g), int(b), int(brightness))
+        Config.MATRIX.updateAll(r, g, b, brightness)
         return json_response({"success": True})
 
+    @route('/jumbotron/draw', method='POST')
+    def draw(post_data):
+        if not post_data:
+            return json_response({"success": False, "error": "No operations in the request body."}, status=400)
+        try:
+            operations = parse_operations(post_data)
+            # One transaction: either every operation lands in a single new version, or none of them do
+            with Config.MATRIX.edit() as pixels:
+                apply_operations(pixels, operations)
+        except DrawError as e:
+            Config.LOGGER.warning("Rejected draw request: %s", e)
+            return json_response({"success": False, "error": str(e)}, status=400)
+        Config.LOGGER.info("Drew %d operations", len(operations))
+        return json_response({"success": True, "operations": len(operations)})
+
     @route('/jumbotron/reset', method='GET')
     def reset():
         global video_is_playing
         Config.LOGGER.info("Resetting all pixels")
         video_is_playing = False
-        time.sleep(1 / Config.UPDATES_PER_SECOND)
+        video_player.stop()
         Config.MATRIX.reset()
         return json_response({"success": True})
 
-    @route('/jumbotron/upload/<int:brightness>', method='POST')
+    @route('/jumbotron/upload/<int:brightness>', method='POST', upload_types=('image/',))
     def upload_image(post_data=None, form=None, brightness=1):
         global video_is_playing
         Config.LOGGER.info("Uploading image")
@@ -191,18 +156,16 @@ try:
             return json_response({'error': 'No file selected for uploading.'}, status=400)
 
         video_is_playing = False
-        time.sleep(1 / Config.UPDATES_PER_SECOND)
-        file_data = file_field.file.read()
-        image = Image.open(BytesIO(file_data))
-        matrix_representation = Jumbotron.convert_image_to_matrix(image, int(brightness))
-        Config.MATRIX.update_from_matrix_array(matrix_representation)
+        video_player.stop()
+        image = Image.open(file_field.file)
+        image_array = Jumbotron.convert_image_to_array(image, brightness)
+        Config.MATRIX.update_from_matrix_array(image_array)
         Config.LOGGER.info("Image uploaded successfully")
-        save_state({'type': 'image', 'content': matrix_representation})
-        return json_response(matrix_representation)
+        save_state({'type': 'image', 'content': image_array})
+        return json_response(array_to_matrix(image_array))
 
     @route('/jumbotron/brightness/<int:brightness>', method='POST')
     def brightness_update(post_data, brightness):
-        brightness = int(brightness)
         Config.LOGGER.info("Updating brightness to %d", brightness)
         Config.MATRIX.updateBrightness(brightness)
         return json_response({"success": True})
@@ -213,6 +176,14 @@ try:
         brightness = Config.MATRIX.getBrightness()
         return json_response({"brightness": brightness})
 
+    @route('/jumbotron/preview/stats', method='GET')
+    def get_preview_stats():
+        return json_response(preview_hub.get_stats())
+
+    @route('/jumbotron/playback/stats', method='GET')
+    def get_playback_stats():
+        return json_response(video_player.get_stats())
+
     @route('/jumbotron/save_current_matrix/<string:matrixname>', method='POST')
     def save_current_matrix(post_data, matrixname):
         global video_is_playing, temp_filename
@@ -222,7 +193,7 @@ try:
             os.makedirs(Config.SAVES_DIR)
 
         save_data = {}
-        if video_is_playing:
+        if video_is_playing and temp_filename:
             Config.LOGGER.info("Video is currently playing - saving the video file")
             try:
                 current_video_filepath = temp_filename
@@ -233,15 +204,25 @@ try:
                 return json_response({"success": False, "error": str(e)}, status=500)
         else:
             Config.LOGGER.info("Saving current matrix as a still frame")
-            current_matrix_state = Config.MATRIX.get2DArrayRepresentation()
             save_data['type'] = 'image'
-            save_data['content'] = current_matrix_state
+            save_data['content'] = Config.MATRIX.get_array()
 
-        filename = f"{matrixname}.json"
+        filename = f"{matrixname}{Config.SAVE_EXTENSION}"
         filepath = os.path.join(Config.SAVES_DIR, filename)
         try:
-            with open(filepath, 'w') as file:
-                json.dump(save_data, file)
+            saveformat.write(filepath, save_data, compress=Config.COMPRESS_SAVES)
+            saves_catalog.record(filename, save_data)
+            # Saving over a legacy JSON save of the same name replaces it
+            legacy_filename = f"{matrixname}.json"
+            if os.path.exists(os.path.join(Config.SAVES_DIR, legacy_filename)):
+                os.remove(os.path.join(Config.SAVES_DIR, legacy_filename))
+                saves_catalog.remove(legacy_filename)
+            try:
+                write_thumbnail(filepath, save_data)
+            except Exception as e:
+                # A stale thumbnail would show the previous content, so fall back to rendering it on request
+                Config.LOGGER.warning("Could not render thumbnail for %s: %s", filename, str(e))
+                remove_thumbnail(filepath)
             Config.LOGGER.info("Current content saved successfully")
             return json_response({"success": True, "filename": filename})
         except Exception as e:
@@ -251,15 +232,8 @@ try:
     @route('/jumbotron/get_saved_matrices', method='GET')
     def get_saved_matrices():
         Config.LOGGER.info("Getting saved matrices")
-        if not os.path.exists(Config.SAVES_DIR):
-            os.makedirs(Config.SAVES_DIR)
-
-        files = [
-            f for f in os.listdir(Config.SAVES_DIR)
-            if os.path.isfile(os.path.join(Config.SAVES_DIR, f)) and f.endswith(".json")
-        ]
-
-        data = [{"filename": f, "image": f"/jumbotron/get_saved_matrix_image/{f}"} for f in files]
+        data = [dict(entry, image=f"/jumbotron/get_saved_matrix_image/{entry['filename']}")
+                for entry in saves_catalog.entries()]
 
         Config.LOGGER.info("Saved matrices retrieved successfully")
         return json_response(data)
@@ -267,14 +241,14 @@ try:
     @route('/jumbotron/play_saved_matrix/<string:filename>', method='GET')
     def play_saved_matrix(filename):
         Config.LOGGER.info("Playing saved matrix: %s", filename)
-        filepath = os.path.join(Config.SAVES_DIR, filename)
+        entry = saves_catalog.get(filename)
 
         try:
-            with open(filepath, 'r') as file:
-                saved_content = json.load(file)
+            if entry is None:
+                raise FileNotFoundError(filename)
 
-            if saved_content['type'] == 'image':
-                Config.MATRIX.update_from_matrix_array(saved_content['content'])
+            if entry['type'] == 'image':
+                Config.MATRIX.update_from_matrix_array(saves_catalog.frame(filename))
                 Config.LOGGER.info("Saved matrix played successfully")
                 return json_response({"success": True})
             else:
@@ -294,16 +268,18 @@ try:
 
         if os.path.exists(filepath):
             try:
-                with open(filepath, 'r') as file:
-                    saved_content = json.load(file)
-                    if saved_content['type'] == 'video':
-                        video_path = saved_content['content']
-                        if os.path.exists(video_path):
-                            os.remove(video_path)
-                            Config.LOGGER.info("Video file deleted successfully")
-                        else:
-                            Config.LOGGER.warning("Video file does not exist")
+                saved_content = saveformat.read(filepath)
+                if saved_content['type'] == 'video':
+                    video_path = saved_content['content']
+                    if video_path and os.path.exists(video_path):
+                        os.remove(video_path)
+                        remove_video_cache(video_path)
+                        Config.LOGGER.info("Video file deleted successfully")
+                    else:
+                        Config.LOGGER.warning("Video file does not exist")
                 os.remove(filepath)
+                saves_catalog.remove(filename)
+                remove_thumbnail(filepath)
                 Config.LOGGER.info("Saved matrix deleted successfully")
                 return json_response({"success": True})
             except Exception as e:
@@ -317,39 +293,39 @@ try:
     def activate_saved_matrix(post_data, filename):
         global temp_filename, video_is_playing
         Config.LOGGER.info("Activating saved matrix: %s", filename)
-        filepath = os.path.join(Config.SAVES_DIR, filename)
+        # The catalog answers what the save is without opening it, image frames come from its cache
+        entry = saves_catalog.get(filename)
 
         try:
-            with open(filepath, 'r') as file:
-                saved_content = json.load(file)
+            if entry is None:
+                raise FileNotFoundError(filename)
 
-            if not isinstance(saved_content, dict):
+            if entry['type'] is None:
                 Config.LOGGER.error("Invalid content format in file: %s", filename)
                 return json_response({"success": False, "error": "Invalid content format."}, status=400)
 
-            if 'type' not in saved_content or 'content' not in saved_content:
-                Config.LOGGER.error("Missing required keys in saved content: %s", filename)
-                return json_response({"success": False, "error": "Invalid content format."}, status=400)
-
-            video_is_playing = False
-            time.sleep(1 / Config.UPDATES_PER_SECOND)
+            # Stopping waits for the playback stages to let go of the panel, switching stills has nothing to stop
+            if video_is_playing:
+                video_is_playing = False
+                video_player.stop()
 
-            if saved_content['type'] == 'video':
-                video_path = saved_content['content']
-                if os.path.exists(video_path):
+            if entry['type'] == 'video':
+                video_path = entry['video']
+                if video_path and os.path.exists(video_path):
                     video_is_playing = True
                     temp_filename = video_path
                     save_state({'type': 'video', 'filename': filename, 'brightness': 40})
-                    eventlet.spawn(video_playback_thread)
+                    video_player.play(temp_filename)
                 else:
                     Config.LOGGER.error("Video file not found: %s", video_path)
                     return json_response({"success": False, "error": "Video file not found."}, status=404)
-            elif saved_content['type'] == 'image':
-                Config.MATRIX.update_from_matrix_array(saved_content['content'])
+            elif entry['type'] == 'image':
+                frame = saves_catalog.frame(filename)
+                Config.MATRIX.update_from_matrix_array(frame)
                 video_is_playing = False
-                save_state({'type': 'image', 'content': saved_content['content']})
+                save_state({'type': 'image', 'content': frame})
             else:
-                Config.LOGGER.error("Unknown content type: %s", saved_content['type'])
+                Config.LOGGER.error("Unknown content type: %s", entry['type'])
                 return json_response({"success": False, "error": "Unknown content type."}, status=400)
 
             Config.LOGGER.info("Saved content activated successfully")
@@ -358,55 +334,42 @@ try:
         except FileNotFoundError:
             Config.LOGGER.error("Saved content file not found: %s", filename)
             return json_response({"success": False, "error": "File does not exist."}, status=404)
-        except json.JSONDecodeError:
-            Config.LOGGER.error("Invalid JSON format in file: %s", filename)
-            return json_response({"success": False, "error": "Invalid JSON format."}, status=400)
+        except saveformat.SaveFormatError as e:
+            Config.LOGGER.error("Invalid save file %s: %s", filename, str(e))
+            return json_response({"success": False, "error": "Invalid save format."}, status=400)
         except Exception as e:
             Config.LOGGER.error(f"Error activating saved content: {str(e)}")
             return json_response({"success": False, "error": str(e)}, status=500)
 
     @route('/jumbotron/get_saved_matrix_image/<string:filename>', method='GET')
-    def get_saved_matrix_image(filename):
+    def get_saved_matrix_image(filename, headers):
         Config.LOGGER.info("Getting preview for saved content: %s", filename)
         filepath = os.path.join(Config.SAVES_DIR, filename)
+        thumbnail = thumbnail_path(filepath)
 
         try:
-            with open(filepath, 'r') as file:
-                saved_content = json.load(file)
-
-            if saved_content['type'] == 'video':
-                video_path = saved_content['content']
-                if not os.path.exists(video_path):
-                    Config.LOGGER.error("Video file not found: %s", video_path)
-                    return json_response({"success": False, "error": "Video file not found."}, status=404)
-
-                cap = cv2.VideoCapture(video_path)
-                success, frame = cap.read()
-                cap.release()
-                if not success:
-                    Config.LOGGER.error("Failed to capture frame from video: %s", video_path)
-                    return json_response({"success": False, "error": "Failed to capture frame from video."}, status=500)
-
-                image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-            elif saved_content['type'] == 'image':
-                image = convert_matrix_to_image(saved_content['content'])
-            else:
-                Config.LOGGER.error("Unknown content type: %s", saved_content['type'])
-                return json_response({"success": False, "error": "Unknown content type."}, status=400)
-
-            byte_io = BytesIO()
-            image.save(byte_io, 'PNG')
-            byte_io.seek(0)
-            return send_file(byte_io, mime_type='image/png')
+            if not os.path.exists(thumbnail):
+                # Saves made before thumbnails existed get theirs rendered on first request
+                write_thumbnail(filepath, saveformat.read(filepath))
+
+            etag, last_modified = validators(thumbnail)
+            cache_headers = {"ETag": etag, "Last-Modified": last_modified, "Cache-Control": "no-cache"}
+            if is_fresh(headers, etag, last_modified):
+                return None, 304, 'image/png', cache_headers
+            with open(thumbnail, 'rb') as file:
+                return file.read(), 200, 'image/png', cache_headers
         except FileNotFoundError:
             Config.LOGGER.error("Content file not found: %s", filename)
             return json_response({"success": False, "error": "File does not exist."}, status=404)
+        except ThumbnailError as e:
+            Config.LOGGER.error("Error rendering thumbnail: %s", str(e))
+            return json_response({"success": False, "error": str(e)}, status=500)
         except Exception as e:
             Config.LOGGER.error(f"Error getting saved content image: {str(e)}")
             return json_response({"success": False, "error": str(e)}, status=500)
 
-    @route('/jumbotron/playvideo/<int:brightness>', method='POST')
-    def play_video(post_data, form, brightness):
+    @route('/jumbotron/playvideo/<int:brightness>', method='POST', upload_types=('video/',))
+    def play_video(post_data=None, form=None, brightness=40):
         global temp_filename, video_is_playing
         Config.LOGGER.info("Playing video")
         if 'file' not in form:
@@ -419,18 +382,20 @@ try:
             return json_response({'error': 'No file selected for uploading.'}, status=400)
 
         video_is_playing = False
-        time.sleep(1 / Config.UPDATES_PER_SECOND)
+        video_player.stop()
 
         filename = os.path.basename(file_field.filename)
         permanent_file_path = os.path.join(Config.SAVES_DIR, filename)
-        with open(permanent_file_path, 'wb') as f:
-            f.write(file_field.file.read())
+        # The upload already sits in the saves directory, so this is a rename rather than a copy
+        os.replace(file_field.path, permanent_file_path)
         temp_filename = permanent_file_path
+        # Start transcoding right away, playback begins as soon as the first frames are cached
+        get_video_cache(permanent_file_path)
 
         try:
             video_is_playing = True
             save_state({'type': 'video', 'filename': permanent_file_path, 'brightness': brightness})
-            eventlet.spawn(video_playback_thread)
+            video_player.play(temp_filename)
             return json_response({'success': True})
         except Exception as e:
             Config.LOGGER.error("Error playing video: %s", str(e))
@@ -447,41 +412,47 @@ try:
         if old_server.stdout:
             subprocess.run(["kill", "-9", old_server.stdout])
         
-        with socketserver.TCPServer(("", Config.HTTP_PORT), Handler) as httpd:
-            Config.LOGGER.info(f"Serving HTTP on port {Config.HTTP_PORT}")
+        with PooledHTTPServer(("", Config.HTTP_PORT), Handler, Config.HTTP_WORKERS) as httpd:
+            Config.LOGGER.info(f"Serving HTTP on port {Config.HTTP_PORT} with {Config.HTTP_WORKERS} workers")
             httpd.serve_forever()
     
     async def main():
+        global video_is_playing, temp_filename
         # Create empty matrix of pixels
-        Config.LOGGER.info("Creating matrix of pixels %d x %d on GPIO PIN %d", Config.ROWS, Config.COLUMNS, Config.PIN)
-        Config.MATRIX = Jumbotron(Config.ROWS, Config.COLUMNS, Config.PIN)
+        Config.LOGGER.info("Creating matrix of pixels %d x %d on GPIO PIN(s) %s", Config.ROWS, Config.COLUMNS,
+                           ", ".join(str(output["pin"]) for output in Config.OUTPUTS))
+        Config.MATRIX = Jumbotron(Config.ROWS, Config.COLUMNS, Config.PIN, outputs=Config.OUTPUTS)
         Config.LOGGER.info("Matrix created successfully")
+        Config.LOGGER.info("Calibrating refresh rate")
+        calibrate(Config.MATRIX)
+        # Paint batches and HTTP mutations commit without waiting for the strip; this thread pushes them at most once per tick
+        Config.MATRIX.start_renderer()
         Config.LOGGER.info("Loading last state")
         last_state = load_state()
         if last_state:
             if last_state['type'] == 'video':
-                video_path = Config.SAVES_DIR + "/" + last_state.get('filename')
-                
-                # Retrieve the content
-                with open(video_path, 'r') as file:
-                    video_path = json.load(file)['content']
-                
-                if os.path.exists(video_path):
+                # Activated saves record the save's name, uploaded videos the path of the video itself
+                entry = saves_catalog.get(last_state.get('filename'))
+                video_path = entry.get('video') if entry else last_state.get('filename')
+
+                if video_path and os.path.exists(video_path):
                     # Play the video
                     video_is_playing = True
                     temp_filename = video_path  # Update the global variable
-                    eventlet.spawn(video_playback_thread)
+                    video_player.play(temp_filename)
                 else:
                     Config.LOGGER.error("Video file not found at startup: %s", video_path)
             elif last_state['type'] == 'image':
                 # Display the image
                 Config.MATRIX.update_from_matrix_array(last_state['content'])
         Config.LOGGER.info("Last state loaded successfully")
+        state_writer.start()
+        Config.MATRIX.add_listener(persist_painted_frame)
         Config.LOGGER.info("Starting Jumbotron API")
         Config.LOGGER.info("Jumbotron API started successfully")
-        async with websockets.serve(jumbotron_updater, "0.0.0.0", Config.WS_PORT):
+        async with websockets.serve(preview_hub.handle, "0.0.0.0", Config.WS_PORT, subprotocols=SUBPROTOCOLS):
             Config.LOGGER.info(f"WebSocket server started on ws://localhost:{Config.WS_PORT}")
-            await asyncio.Future() 
+            await preview_hub.run(thread_stop_event)
 
             
 except KeyboardInterrupt as e:
@@ -502,6 +473,7 @@ if __name__ == '__main__':
     except KeyboardInterrupt as e:
         Config.LOGGER.info("Keyboard interrupt received")
         thread_stop_event.set()
+        state_writer.flush()
         Config.LOGGER.info("Stopping Jumbotron API")
         Config.LOGGER.info("Jumbotron API stopped successfully")
         Config.LOGGER.info("Exiting")
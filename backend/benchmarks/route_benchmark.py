@@ -0,0 +1,93 @@
+# Compares the old linear regex scan over every route with the per-method route tree, for the painting routes.
+# With today's ~20 routes the two are about even; the tree is there so dispatch stays flat as routes are added,
+# which the second run shows by registering 200 unrelated routes ahead of the painting ones.
+# Run from the backend directory: python3 benchmarks/route_benchmark.py
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from utils.httpDecorator import RouteTable
+
+ITERATIONS = 20000
+
+# The routes api.py registers, in registration order
+ROUTES = [
+    ('/', 'GET'),
+    ('/jumbotron', 'GET'),
+    ('/jumbotron/pixel/<int:row>/<int:column>/<int:r>/<int:g>/<int:b>/<int:brightness>', 'GET'),
+    ('/jumbotron/row/<int:row>/<int:r>/<int:g>/<int:b>/<int:brightness>', 'GET'),
+    ('/jumbotron/column/<int:column>/<int:r>/<int:g>/<int:b>/<int:brightness>', 'GET'),
+    ('/jumbotron/all/<int:r>/<int:g>/<int:b>/<int:brightness>', 'GET'),
+    ('/jumbotron/draw', 'POST'),
+    ('/jumbotron/reset', 'GET'),
+    ('/jumbotron/upload/<int:brightness>', 'POST'),
+    ('/jumbotron/brightness/<int:brightness>', 'POST'),
+    ('/jumbotron/brightness', 'GET'),
+    ('/jumbotron/preview/stats', 'GET'),
+    ('/jumbotron/playback/stats', 'GET'),
+    ('/jumbotron/save_current_matrix/<string:matrixname>', 'POST'),
+    ('/jumbotron/get_saved_matrices', 'GET'),
+    ('/jumbotron/play_saved_matrix/<string:filename>', 'GET'),
+    ('/jumbotron/delete_saved_matrix/<string:filename>', 'POST'),
+    ('/jumbotron/activate_saved_matrix/<string:filename>', 'POST'),
+    ('/jumbotron/get_saved_matrix_image/<string:filename>', 'GET'),
+    ('/jumbotron/playvideo/<int:brightness>', 'POST'),
+]
+
+PAINT_PATHS = [
+    '/jumbotron/pixel/12/34/255/128/0/100',
+    '/jumbotron/row/5/0/255/0/100',
+    '/jumbotron/column/63/0/0/255/100',
+    '/jumbotron/all/0/0/0/255',
+]
+
+def legacy_compile(path_pattern):
+    # The original @route compilation: one anchored regex per route
+    def replacer(match):
+        var_type, var_name = match.groups()
+        if var_type == 'int':
+            return r'(?P<{}>\d+)'.format(var_name)
+        return r'(?P<{}>[^/]+)'.format(var_name)
+    return re.compile('^' + re.sub(r'<(int|string):(\w+)>', replacer, path_pattern) + '$')
+
+def legacy_match(registry, method, path):
+    # The original do_GET/do_POST: try every route in turn, then each handler converts its own parameters
+    for pattern, route_method, func in registry:
+        if route_method == method:
+            match = pattern.match(path)
+            if match:
+                return func, {name: int(value) if value.isdigit() else value for name, value in match.groupdict().items()}
+    return None, {}
+
+def build(routes):
+    registry, table = [], RouteTable()
+    for index, (path_pattern, method) in enumerate(routes):
+        handler = f"handler{index}"
+        registry.append((legacy_compile(path_pattern), method, handler))
+        table.add(method, path_pattern, handler)
+    return registry, table
+
+def dispatch_all(match, *args):
+    for path in PAINT_PATHS:
+        match(*args, 'GET', path)
+
+def main():
+    for extra in (0, 200):
+        # Unrelated routes registered ahead of the painting ones, as more features get added
+        routes = [(f'/plugin{index}/action/<int:value>', 'GET') for index in range(extra)] + ROUTES
+        registry, table = build(routes)
+        for path in PAINT_PATHS:
+            assert legacy_match(registry, 'GET', path) == table.match('GET', path), f"{path} dispatched differently"
+
+        legacy = timeit.timeit(lambda: dispatch_all(legacy_match, registry), number=ITERATIONS) / (ITERATIONS * len(PAINT_PATHS))
+        tree = timeit.timeit(lambda: dispatch_all(table.match), number=ITERATIONS) / (ITERATIONS * len(PAINT_PATHS))
+
+        print(f"{len(routes)} routes, {ITERATIONS * len(PAINT_PATHS)} painting requests each")
+        print(f"linear regex scan: {legacy * 1e6:8.2f} us/request")
+        print(f"route tree:        {tree * 1e6:8.2f} us/request (scan takes {legacy / tree:.2f}x as long)")
+
+if __name__ == '__main__':
+    main()
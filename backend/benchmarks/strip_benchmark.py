@@ -0,0 +1,61 @@
+# Compares the old per-pixel strip update with the precomputed index map + bulk copy on the mock strip.
+# Run from the backend directory: python3 benchmarks/strip_benchmark.py
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+from utils.config import Config
+from utils.jumbotron import Jumbotron, array_to_matrix
+from utils.mock_rpi_ws281x import PixelStrip, Color
+
+ITERATIONS = 200
+
+def legacy_update_strip(strip, matrix, rows, columns):
+    # The original _update_strip: zig-zag index, brightness factor and Color() for every pixel
+    for row in range(rows):
+        for column in range(columns):
+            pixel = matrix[row][column]
+            mapped_row = rows - row - 1
+            if mapped_row % 2 == 0:
+                index = (mapped_row * columns) + column
+            else:
+                index = (mapped_row * columns) + (columns - column - 1)
+
+            brightness_factor = pixel['brightness'] / 100.0
+            strip.setPixelColor(index, Color(int(pixel['r'] * brightness_factor),
+                                             int(pixel['g'] * brightness_factor),
+                                             int(pixel['b'] * brightness_factor)))
+    strip.show()
+
+def main():
+    rows, columns = Config.ROWS, Config.COLUMNS
+    frame = np.random.default_rng(0).integers(0, 256, (rows, columns, 4), dtype=np.uint8)
+    frame[..., 3] %= 101
+
+    jumbotron = Jumbotron(rows, columns, Config.PIN)
+    legacy_strip = PixelStrip(rows * columns)
+
+    # Leave the mock's wire time out so only the CPU cost of each path is compared
+    for strip in [legacy_strip] + [output.strip for output in jumbotron._outputs]:
+        strip._wire_time = 0
+
+    jumbotron.update_from_matrix_array(frame)
+    matrix = array_to_matrix(frame)
+    legacy_update_strip(legacy_strip, matrix, rows, columns)
+    # The legacy float brightness factor can truncate one step lower than the integer math, nothing more
+    legacy_leds = np.array(legacy_strip.getPixels(), dtype=np.uint32).view(np.uint8)
+    bulk_leds = np.array(sum((output.strip.getPixels() for output in jumbotron._outputs), []), dtype=np.uint32).view(np.uint8)
+    assert np.abs(legacy_leds.astype(int) - bulk_leds).max() <= 1, "LED buffers differ between the two paths"
+
+    legacy = timeit.timeit(lambda: legacy_update_strip(legacy_strip, matrix, rows, columns), number=ITERATIONS) / ITERATIONS
+    bulk = timeit.timeit(lambda: jumbotron._update_strip(force=True), number=ITERATIONS) / ITERATIONS
+
+    print(f"{rows}x{columns} panel, {ITERATIONS} frames each")
+    print(f"per-pixel setPixelColor: {legacy * 1000:8.3f} ms/frame")
+    print(f"index map + bulk copy:   {bulk * 1000:8.3f} ms/frame ({legacy / bulk:.1f}x faster)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import time
+import websockets
+from utils.config import Config
+from utils.drawing import DrawError, apply_operations, parse_operations
+from utils.preview import encode_heartbeat, negotiate_stream
+
+# Weight of the newest sample in each client's moving average of send latency
+LATENCY_SMOOTHING = 0.2
+
+class PreviewClient:
+    """One subscriber: a latest-frame-wins slot drained by its own sender task at a rate adapted to its link."""
+    def __init__(self, websocket, stream):
+        self.websocket = websocket
+        self.stream = stream
+        self._slot = None
+        self._heartbeat_due = False
+        self._ready = asyncio.Event()
+        self._sending = False
+        self._next_send = 0.0
+
+        self.send_latency = 0.0
+        self.frames_sent = 0
+        # Frames replaced in the slot while throttled to the client's rate, or while a previous send was still in flight
+        self.frames_coalesced = 0
+        self.frames_dropped = 0
+
+    def offer(self, snapshot):
+        # Never queues: a newer frame simply replaces the one waiting, so a slow client only ever falls behind by one
+        if self._slot is not None and self._slot.version != snapshot.version:
+            if self._sending:
+                self.frames_dropped += 1
+            else:
+                self.frames_coalesced += 1
+        self._slot = snapshot
+        self._ready.set()
+
+    def offer_heartbeat(self, snapshot):
+        if self._slot is None:
+            self._slot = snapshot
+            self._heartbeat_due = True
+            self._ready.set()
+
+    def get_stats(self):
+        return {
+            "client": "%s:%s" % self.websocket.remote_address[:2],
+            "format": self.stream.format,
+            "scale": self.stream.scale,
+            "region": self.stream.region,
+            "send_latency_ms": round(self.send_latency * 1000, 2),
+            "max_fps": round(1 / self._interval(), 2),
+            "frames_sent": self.frames_sent,
+            "frames_coalesced": self.frames_coalesced,
+            "frames_dropped": self.frames_dropped,
+        }
+
+    def _interval(self):
+        # Never faster than the panel refreshes or the client asked for, and slower for clients whose sends take long
+        max_fps = min(Config.UPDATES_PER_SECOND, self.stream.max_fps or Config.UPDATES_PER_SECOND)
+        return max(1 / max_fps, self.send_latency * Config.PREVIEW_LATENCY_MULTIPLIER)
+
+    async def run(self):
+        while True:
+            await self._ready.wait()
+            delay = self._next_send - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._ready.clear()
+
+            snapshot, heartbeat = self.stream.view(self._slot), self._heartbeat_due
+            self._slot, self._heartbeat_due = None, False
+            if self.stream.is_current(snapshot):
+                if not heartbeat:
+                    continue
+                message = encode_heartbeat(snapshot, self.stream.format)
+            else:
+                # Clients needing the same message share one encode through the snapshot's cache
+                message = snapshot.cached(('message',) + self.stream.plan(snapshot), lambda: self.stream.encode(snapshot))
+
+            start = time.monotonic()
+            self._sending = True
+            try:
+                await self.websocket.send(message)
+            except websockets.ConnectionClosed:
+                return
+            except Exception as e:
+                Config.LOGGER.error("Error sending preview to %s: %s", self.websocket.remote_address, str(e))
+                return
+            finally:
+                self._sending = False
+            self.send_latency += (time.monotonic() - start - self.send_latency) * LATENCY_SMOOTHING
+            self.stream.acknowledge(snapshot, message)
+            self.frames_sent += 1
+            self._next_send = start + self._interval()
+
+class PreviewHub:
+    """Single broadcaster for the WebSocket preview: new frames are offered to every client's slot as they are committed."""
+    def __init__(self):
+        # websocket -> PreviewClient of every connected client
+        self._clients = {}
+        self._frame_ready = None
+
+    def client_count(self):
+        return len(self._clients)
+
+    def get_stats(self):
+        return [client.get_stats() for client in list(self._clients.values())]
+
+    async def handle(self, websocket):
+        # websockets.serve handler: subscribe the client and keep it registered until the connection closes
+        client = PreviewClient(websocket, negotiate_stream(websocket))
+        self._clients[websocket] = client
+        Config.LOGGER.client_connect("Client %s connected (%s preview, 1/%d scale, region %s, %d watching)",
+                                     websocket.remote_address, client.stream.format, client.stream.scale,
+                                     client.stream.region, len(self._clients))
+        if Config.MATRIX is not None:
+            client.offer(Config.MATRIX.snapshot())
+
+        sender = asyncio.create_task(client.run())
+        receiver = asyncio.create_task(self._receive(websocket))
+        try:
+            await asyncio.wait([sender, receiver], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            sender.cancel()
+            receiver.cancel()
+            self._clients.pop(websocket, None)
+            Config.LOGGER.client_disconnect("Client %s disconnected (%d watching): %s",
+                                            websocket.remote_address, len(self._clients), client.get_stats())
+
+    async def _receive(self, websocket):
+        # Paint channel: every inbound message is one batch of drawing operations, committed as a single version
+        try:
+            async for message in websocket:
+                try:
+                    operations = parse_operations(message)
+                    with Config.MATRIX.edit() as pixels:
+                        apply_operations(pixels, operations)
+                except DrawError as e:
+                    Config.LOGGER.warning("Rejected paint batch from %s: %s", websocket.remote_address, e)
+                    await websocket.send(json.dumps({'error': str(e)}))
+                except Exception as e:
+                    # One bad batch must not take down the client's preview with it
+                    Config.LOGGER.error("Error applying paint batch from %s: %s", websocket.remote_address, str(e))
+                    await websocket.send(json.dumps({'error': str(e)}))
+        except websockets.ConnectionClosed:
+            pass
+
+    async def run(self, stop_event):
+        # Frames are pushed when the framebuffer commits a new version instead of being polled at a fixed rate
+        loop = asyncio.get_running_loop()
+        self._frame_ready = asyncio.Event()
+
+        def on_new_version(version):
+            try:
+                loop.call_soon_threadsafe(self._frame_ready.set)
+            except RuntimeError:
+                pass  # The event loop is shutting down
+        Config.MATRIX.add_listener(on_new_version)
+
+        while not stop_event.is_set():
+            try:
+                await asyncio.wait_for(self._frame_ready.wait(), timeout=Config.PREVIEW_HEARTBEAT_SECONDS)
+                changed = True
+            except asyncio.TimeoutError:
+                changed = False
+            self._frame_ready.clear()
+
+            snapshot = Config.MATRIX.snapshot()
+            for client in list(self._clients.values()):
+                if changed:
+                    client.offer(snapshot)
+                else:
+                    client.offer_heartbeat(snapshot)
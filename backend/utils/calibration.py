@@ -0,0 +1,33 @@
+import time
+from utils.config import Config
+
+# WS281x LEDs take 24 bits per pixel, and the driver holds the line low this long after a frame so it latches
+BITS_PER_LED = 24
+RESET_TIME_US = 300
+
+def wire_time(led_count, freq_hz=800000):
+    """Seconds it takes to clock one frame of led_count LEDs out on a single data line."""
+    return led_count * BITS_PER_LED / freq_hz + RESET_TIME_US / 1000000
+
+def measure_max_fps(jumbotron, frames=None):
+    """Push the current frame back to back and return the refresh rate the strip actually sustained."""
+    frames = frames or Config.CALIBRATION_FRAMES
+
+    # The first push only fills the pipeline, every push after it has to wait for the one before
+    jumbotron.refresh()
+    start = time.monotonic()
+    for _ in range(frames):
+        jumbotron.refresh()
+    return frames / (time.monotonic() - start)
+
+def calibrate(jumbotron):
+    """Measure the achievable refresh rate and cap the playback and preview rates to it."""
+    theoretical = 1 / jumbotron.get_wire_time()
+    measured = min(measure_max_fps(jumbotron), theoretical)
+    Config.LOGGER.info("Strip calibrated: %.1f frames/s measured, %.1f frames/s theoretical", measured, theoretical)
+
+    if Config.UPDATES_PER_SECOND > measured:
+        Config.LOGGER.warning("UPDATES_PER_SECOND of %s cannot be reached on the wire, capping it to %.1f",
+                              Config.UPDATES_PER_SECOND, measured)
+        Config.UPDATES_PER_SECOND = measured
+    return measured
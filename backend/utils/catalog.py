@@ -0,0 +1,141 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+import cv2
+from utils import saveformat
+from utils.config import Config
+from utils.saveformat import matrix_to_array
+from utils.thumbnails import thumbnail_path
+
+
+class SaveCatalog:
+    """Persistent index of the saves directory, plus an LRU cache of decoded image frames."""
+    def __init__(self, directory=None, cache_size=None):
+        self._directory = directory or Config.SAVES_DIR
+        self._path = os.path.join(self._directory, Config.CATALOG_FILE)
+        self._cache_size = cache_size or Config.FRAME_CACHE_SIZE
+        self._lock = threading.Lock()
+        # filename -> entry, and filename -> read-only (rows, columns, 4) frame, least recently used first
+        self._entries = {}
+        self._frames = OrderedDict()
+        self._load()
+
+    def _read_save(self, filename):
+        return saveformat.read(os.path.join(self._directory, filename), use_mmap=True)
+
+    def _describe(self, filename, save_data, created):
+        # Catalog entry of one save; type is None for files that aren't a valid save
+        entry = {
+            "filename": filename,
+            "name": os.path.splitext(filename)[0],
+            "type": None,
+            "size": os.path.getsize(os.path.join(self._directory, filename)),
+            "rows": None,
+            "columns": None,
+            "created": created,
+            "thumbnail": os.path.basename(thumbnail_path(filename)),
+        }
+        if not isinstance(save_data, dict) or 'type' not in save_data or 'content' not in save_data:
+            return entry
+
+        entry["type"] = save_data['type']
+        if save_data['type'] == 'image':
+            entry["rows"], entry["columns"] = matrix_to_array(save_data['content']).shape[:2]
+        elif save_data['type'] == 'video':
+            entry["video"] = save_data['content']
+            capture = cv2.VideoCapture(save_data['content'] or '')
+            if capture.isOpened():
+                entry["rows"] = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+                entry["columns"] = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+            capture.release()
+        return entry
+
+    def _load(self):
+        os.makedirs(self._directory, exist_ok=True)
+        try:
+            with open(self._path, 'r') as file:
+                entries = json.load(file)
+            self._entries = {entry["filename"]: entry for entry in entries if entry.get("type")}
+            changed = len(self._entries) != len(entries)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            self._entries = {}
+            changed = False
+
+        # One directory scan at startup picks up saves added or removed behind the catalog's back
+        filenames = {f for f in os.listdir(self._directory)
+                     if f.endswith(('.json', Config.SAVE_EXTENSION)) and not f.startswith('.')
+                     and os.path.isfile(os.path.join(self._directory, f))}
+        for filename in set(self._entries) - filenames:
+            del self._entries[filename]
+            changed = True
+        for filename in filenames - set(self._entries):
+            try:
+                save_data = self._read_save(filename)
+                created = os.path.getmtime(os.path.join(self._directory, filename))
+                entry = self._describe(filename, save_data, created)
+            except Exception as e:
+                # One unreadable file must not keep the server from starting
+                Config.LOGGER.warning("Skipping unreadable save %s: %s", filename, str(e))
+                continue
+            # Other .json files that ended up in the directory aren't saves, listing them would show a broken tile
+            if entry["type"] is None:
+                continue
+            self._entries[filename] = entry
+            changed = True
+        if changed:
+            self._write()
+
+    def _write(self):
+        # Written to a temporary file first so a crash never leaves a truncated catalog
+        temporary_path = self._path + '.tmp'
+        with open(temporary_path, 'w') as file:
+            json.dump(sorted(self._entries.values(), key=lambda entry: entry["filename"]), file)
+        os.replace(temporary_path, self._path)
+
+    def _cache(self, filename, frame):
+        frame.flags.writeable = False
+        self._frames[filename] = frame
+        self._frames.move_to_end(filename)
+        while len(self._frames) > self._cache_size:
+            self._frames.popitem(last=False)
+
+    def entries(self):
+        with self._lock:
+            return sorted(self._entries.values(), key=lambda entry: entry["filename"])
+
+    def get(self, filename):
+        """Return the catalog entry of a save, or None if there is no such save."""
+        with self._lock:
+            return self._entries.get(filename)
+
+    def record(self, filename, save_data):
+        """Add or replace the entry of a save that was just written."""
+        with self._lock:
+            self._entries[filename] = self._describe(filename, save_data, time.time())
+            self._frames.pop(filename, None)
+            if save_data.get('type') == 'image':
+                # A freshly saved scene is likely to be activated next
+                self._cache(filename, matrix_to_array(save_data['content']))
+            self._write()
+
+    def remove(self, filename):
+        with self._lock:
+            self._frames.pop(filename, None)
+            if self._entries.pop(filename, None) is not None:
+                self._write()
+
+    def frame(self, filename):
+        """Return the decoded (rows, columns, 4) frame of an image save, from the cache when recently used."""
+        with self._lock:
+            frame = self._frames.get(filename)
+            if frame is not None:
+                self._frames.move_to_end(filename)
+                return frame
+
+        # Decoded outside the lock so a cache miss doesn't hold up other requests
+        frame = self._read_save(filename)['content']
+        with self._lock:
+            self._cache(filename, frame)
+        return frame
@@ -2,12 +2,49 @@ from utils.logger import create_logger
 
 class Config:
     PIN = 21
+    # LED wiring: corner the data line enters, zig-zag (serpentine) or progressive rows, and rotation in degrees
+    LAYOUT_ORIGIN = "bottom-left"
+    LAYOUT_SERPENTINE = True
+    LAYOUT_ROTATION = 0
     ROWS = 48
     COLUMNS = 64
+    # LED outputs, each driving the next `count` LEDs of the chain from its own pin and DMA channel.
+    # Outputs transfer in parallel, so splitting the panel cuts the wire time per frame. Every output needs a
+    # peripheral of its own: PWM (pin 12 or 18), PCM (pin 21) or SPI (pin 10), e.g.
+    # [{"pin": 18, "dma": 10, "channel": 0, "count": 1024}, {"pin": 21, "dma": 11, "channel": 0, "count": 1024},
+    #  {"pin": 10, "dma": 12, "channel": 0, "count": 1024}]
+    OUTPUTS = [{"pin": PIN, "dma": 10, "channel": 0, "count": ROWS * COLUMNS}]
     MATRIX = None
+    # PIL filter used when scaling images and video frames down to the panel: nearest, box, bilinear, hamming, bicubic or lanczos
+    RESAMPLE_FILTER = "bicubic"
     UPDATES_PER_SECOND = 60;
+    CALIBRATION_FRAMES = 10
+    # Decoded frames video playback may buffer ahead of the panel
+    PLAYBACK_BUFFER_FRAMES = 8
+    # Video playback that falls further behind than this restarts its clock instead of skipping to catch up
+    PLAYBACK_RESYNC_SECONDS = 0.5
     SAVES_DIR = "saves"
-    STATE_FILE = "last_state.json"
+    STATE_FILE = "last_state.jbt"
+    LEGACY_STATE_FILE = "last_state.json"
+    STATE_SAVE_INTERVAL = 2
+    SAVE_EXTENSION = ".jbt"
+    COMPRESS_SAVES = False
+    CATALOG_FILE = ".catalog.json"
+    # Frame caches of uploaded videos, a hidden directory inside SAVES_DIR
+    VIDEO_CACHE_DIR = ".cache"
+    FRAME_CACHE_SIZE = 64
     LOGGER = create_logger()
     HTTP_PORT = 5000
+    HTTP_WORKERS = 16
+    # Idle keep-alive connections wait without holding a worker and are closed after this many seconds
+    HTTP_KEEPALIVE_SECONDS = 5
+    # Seconds a worker waits on a client that stalls in the middle of sending a request
+    HTTP_REQUEST_TIMEOUT = 5
+    MAX_UPLOAD_SIZE = 2 * 1024 ** 3
+    # Delta preview clients get a full keyframe at least once every this many messages
+    PREVIEW_KEYFRAME_INTERVAL = 60
+    # The preview is only sent when the panel changes; while idle clients get a heartbeat this often
+    PREVIEW_HEARTBEAT_SECONDS = 5
+    # Each preview client is throttled to at most one frame per this many times its average send latency
+    PREVIEW_LATENCY_MULTIPLIER = 2
     WS_PORT = 5001
\ No newline at end of file
@@ -0,0 +1,205 @@
+import base64
+import binascii
+import json
+import struct
+import numpy as np
+
+# Batched drawing operations, sent over the WebSocket paint channel or POSTed to /jumbotron/draw, e.g.
+#   {"ops": [{"op": "pixels", "pixels": [[row, column, r, g, b, brightness], ...]},
+#            {"op": "pixel", "row": 1, "column": 2, "r": 255, "g": 255, "b": 255, "brightness": 100},
+#            {"op": "row", "row": 3, ...color}, {"op": "column", "column": 4, ...color},
+#            {"op": "rect", "row": 0, "column": 0, "height": 4, "width": 8, "r": 255, "g": 0, "b": 0, "brightness": 100},
+#            {"op": "line", "from": [0, 0], "to": [47, 63], "r": 0, "g": 255, "b": 0, "brightness": 100},
+#            {"op": "blit", "row": 0, "column": 0, "height": 8, "width": 8, "brightness": 100, "data": "<base64 RGB bytes>"},
+#            {"op": "fill", "r": 0, "g": 0, "b": 0, "brightness": 255}]}
+# Operations are applied in order onto a (rows, columns, 4) framebuffer.
+MAX_OPERATIONS = 4096
+
+# Compact binary form: BINARY_MAGIC, then per operation a u8 opcode followed by its little-endian fields.
+# A blit is followed by height * width * 3 row-major RGB bytes.
+BINARY_MAGIC = b'JBD\x01'
+COLOR_FIELDS = ('r', 'g', 'b', 'brightness')
+BINARY_OPERATIONS = {
+    1: ('pixel', struct.Struct('<HH4B'), ('row', 'column') + COLOR_FIELDS),
+    2: ('row', struct.Struct('<H4B'), ('row',) + COLOR_FIELDS),
+    3: ('column', struct.Struct('<H4B'), ('column',) + COLOR_FIELDS),
+    4: ('rect', struct.Struct('<HHHH4B'), ('row', 'column', 'height', 'width') + COLOR_FIELDS),
+    5: ('fill', struct.Struct('<4B'), COLOR_FIELDS),
+    6: ('blit', struct.Struct('<HHHHB'), ('row', 'column', 'height', 'width', 'brightness')),
+}
+
+
+class DrawError(ValueError):
+    pass
+
+
+def _color(operation):
+    try:
+        color = [int(operation[channel]) for channel in COLOR_FIELDS]
+    except (KeyError, TypeError, ValueError, OverflowError):
+        raise DrawError("%s needs integer r, g, b and brightness" % operation.get('op'))
+    return np.clip(color, 0, 255).astype(np.uint8)
+
+
+def _point(operation, key):
+    try:
+        row, column = (int(value) for value in operation[key])
+    except (KeyError, TypeError, ValueError, OverflowError):
+        raise DrawError("%s needs %s as [row, column]" % (operation.get('op'), key))
+    return row, column
+
+
+def _integer(operation, key):
+    try:
+        return int(operation[key])
+    except (KeyError, TypeError, ValueError, OverflowError):
+        raise DrawError("%s needs an integer %s" % (operation.get('op'), key))
+
+
+def _index(pixels, operation, key, axis):
+    index = _integer(operation, key)
+    if not 0 <= index < pixels.shape[axis]:
+        raise DrawError("%s %d is outside the %dx%d panel" % (key, index, pixels.shape[0], pixels.shape[1]))
+    return index
+
+
+def draw_pixel(pixels, operation):
+    pixels[_index(pixels, operation, 'row', 0), _index(pixels, operation, 'column', 1)] = _color(operation)
+
+
+def draw_row(pixels, operation):
+    pixels[_index(pixels, operation, 'row', 0), :] = _color(operation)
+
+
+def draw_column(pixels, operation):
+    pixels[:, _index(pixels, operation, 'column', 1)] = _color(operation)
+
+
+def draw_pixels(pixels, operation):
+    try:
+        points = np.asarray(operation['pixels'], dtype=np.int64)
+    except (KeyError, TypeError, ValueError, OverflowError):
+        points = None
+    if points is not None and points.size == 0:
+        return
+    # Exactly six values per point, anything else would be reinterpreted as some other set of pixels
+    if points is None or points.ndim != 2 or points.shape[1] != 6:
+        raise DrawError("pixels needs a list of [row, column, r, g, b, brightness]")
+    rows, columns = pixels.shape[:2]
+    inside = (points[:, 0] >= 0) & (points[:, 0] < rows) & (points[:, 1] >= 0) & (points[:, 1] < columns)
+    if not inside.all():
+        raise DrawError("pixels has points outside the %dx%d panel" % (rows, columns))
+    pixels[points[:, 0], points[:, 1]] = np.clip(points[:, 2:], 0, 255)
+
+
+def draw_rect(pixels, operation):
+    row, column = _integer(operation, 'row'), _integer(operation, 'column')
+    height, width = _integer(operation, 'height'), _integer(operation, 'width')
+    if height < 0 or width < 0:
+        raise DrawError("rect needs a non-negative height and width")
+    # Clipped to the panel, so a rect dragged past the edge still paints its visible part
+    pixels[max(row, 0):max(row + height, 0), max(column, 0):max(column + width, 0)] = _color(operation)
+
+
+def draw_fill(pixels, operation):
+    pixels[...] = _color(operation)
+
+
+def draw_line(pixels, operation):
+    (row0, column0), (row1, column1) = _point(operation, 'from'), _point(operation, 'to')
+    steps = max(abs(row1 - row0), abs(column1 - column0)) + 1
+    if steps > sum(pixels.shape[:2]) * 4:
+        raise DrawError("line is too long")
+    line_rows = np.rint(np.linspace(row0, row1, steps)).astype(np.int64)
+    line_columns = np.rint(np.linspace(column0, column1, steps)).astype(np.int64)
+    rows, columns = pixels.shape[:2]
+    inside = (line_rows >= 0) & (line_rows < rows) & (line_columns >= 0) & (line_columns < columns)
+    pixels[line_rows[inside], line_columns[inside]] = _color(operation)
+
+
+def draw_blit(pixels, operation):
+    row, column = _integer(operation, 'row'), _integer(operation, 'column')
+    height, width = _integer(operation, 'height'), _integer(operation, 'width')
+    brightness = min(max(_integer(operation, 'brightness'), 0), 255)
+    data = operation.get('data')
+    if isinstance(data, str):
+        try:
+            data = base64.b64decode(data, validate=True)
+        except binascii.Error:
+            raise DrawError("blit data must be base64")
+    if height < 0 or width < 0 or not isinstance(data, (bytes, bytearray)) or len(data) != height * width * 3:
+        raise DrawError("blit needs height * width * 3 bytes of RGB data")
+
+    # Only the part of the image that lands on the panel is copied
+    image = np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)
+    top, left = max(row, 0), max(column, 0)
+    bottom, right = min(row + height, pixels.shape[0]), min(column + width, pixels.shape[1])
+    if bottom <= top or right <= left:
+        return
+    pixels[top:bottom, left:right, :3] = image[top - row:bottom - row, left - column:right - column]
+    pixels[top:bottom, left:right, 3] = brightness
+
+
+OPERATIONS = {
+    'pixel': draw_pixel,
+    'row': draw_row,
+    'column': draw_column,
+    'pixels': draw_pixels,
+    'blit': draw_blit,
+    'rect': draw_rect,
+    'fill': draw_fill,
+    'line': draw_line,
+}
+
+
+def _parse_binary(body):
+    operations = []
+    offset = len(BINARY_MAGIC)
+    while offset < len(body):
+        code = body[offset]
+        if code not in BINARY_OPERATIONS:
+            raise DrawError("unknown binary operation %d" % code)
+        name, layout, fields = BINARY_OPERATIONS[code]
+        offset += 1
+        if offset + layout.size > len(body):
+            raise DrawError("truncated %s operation" % name)
+        operation = dict(zip(fields, layout.unpack_from(body, offset)), op=name)
+        offset += layout.size
+        if name == 'blit':
+            size = operation['height'] * operation['width'] * 3
+            if offset + size > len(body):
+                raise DrawError("truncated blit data")
+            operation['data'] = bytes(body[offset:offset + size])
+            offset += size
+        operations.append(operation)
+        if len(operations) > MAX_OPERATIONS:
+            raise DrawError("at most %d operations per batch" % MAX_OPERATIONS)
+    return operations
+
+
+def parse_operations(message):
+    """Decode a batch of operations: the compact binary form, {"ops": [...]} or a bare JSON list."""
+    if isinstance(message, (bytes, bytearray)) and message.startswith(BINARY_MAGIC):
+        return _parse_binary(message)
+    try:
+        batch = json.loads(message)
+    except (ValueError, RecursionError):
+        raise DrawError("paint messages must be JSON")
+    operations = batch.get('ops') if isinstance(batch, dict) else batch
+    if not isinstance(operations, list) or not all(isinstance(operation, dict) for operation in operations):
+        raise DrawError("paint messages need a list of operations")
+    if len(operations) > MAX_OPERATIONS:
+        raise DrawError("at most %d operations per batch" % MAX_OPERATIONS)
+    return operations
+
+
+def apply_operations(pixels, operations):
+    """Apply operations in order onto pixels, raising DrawError on the first invalid one."""
+    for operation in operations:
+        if not isinstance(operation, dict):
+            raise DrawError("operations must be JSON objects")
+        name = operation.get('op')
+        draw = OPERATIONS.get(name) if isinstance(name, str) else None
+        if draw is None:
+            raise DrawError("unknown operation %r" % operation.get('op'))
+        draw(pixels, operation)
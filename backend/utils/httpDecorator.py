@@ -1,169 +1,319 @@
 import http.server
+import inspect
 from functools import wraps
 import json
+import os
+import queue
 import re
-import cgi
+import selectors
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils.config import Config
+from utils.multipart import MultipartError, parse_multipart
 
-# A dictionary to hold routes and their associated handlers
-route_registry = []
+def _int_segment(segment):
+    return int(segment) if segment.isascii() and segment.isdigit() else None
 
-# Decorator for registering routes
-def route(path_pattern, method="GET"):
+def _string_segment(segment):
+    return segment or None
+
+# Parameter types usable in route patterns; each returns the converted value, or None if the segment doesn't match
+CONVERTERS = {
+    'int': _int_segment,
+    'string': _string_segment,
+}
+
+PARAMETER_PATTERN = re.compile(r'^<(?:(\w+):)?(\w+)>$')
+
+class RouteNode:
+    def __init__(self):
+        self.static = {}
+        # (name, converter, child) for every <type:name> segment at this depth, tried in registration order
+        self.parameters = []
+        self.handler = None
+
+class RouteTable:
+    """Routes compiled into one prefix tree of path segments per HTTP method.
+
+    Lookup cost follows the path depth rather than the number of routes. At today's route count that is on par
+    with scanning a list of regexes, the tree keeps it that way as more routes get registered.
+    """
+    def __init__(self):
+        self._trees = {}
+
+    def add(self, method, path_pattern, func):
+        node = self._trees.setdefault(method, RouteNode())
+        for segment in path_pattern.split('/')[1:]:
+            parameter = PARAMETER_PATTERN.match(segment)
+            if parameter:
+                var_type, var_name = parameter.groups()
+                converter = CONVERTERS.get(var_type, _string_segment)
+                for name, existing, child in node.parameters:
+                    if name == var_name and existing is converter:
+                        node = child
+                        break
+                else:
+                    child = RouteNode()
+                    node.parameters.append((var_name, converter, child))
+                    node = child
+            else:
+                node = node.static.setdefault(segment, RouteNode())
+        node.handler = func
+
+    def match(self, method, path):
+        """Return (handler, converted parameters) for the path, or (None, {}) if no route matches."""
+        tree = self._trees.get(method)
+        if tree is None:
+            return None, {}
+        params = {}
+        handler = self._match(tree, path.split('?', 1)[0].split('/')[1:], 0, params)
+        return (handler, params) if handler else (None, {})
+
+    def _match(self, node, segments, depth, params):
+        if depth == len(segments):
+            return node.handler
+        segment = segments[depth]
+        # Literal segments win over parameters; fall back to the parameters if the literal branch dead-ends
+        child = node.static.get(segment)
+        if child is not None:
+            handler = self._match(child, segments, depth + 1, params)
+            if handler:
+                return handler
+        for name, converter, child in node.parameters:
+            value = converter(segment)
+            if value is not None:
+                handler = self._match(child, segments, depth + 1, params)
+                if handler:
+                    params[name] = value
+                    return handler
+        return None
+
+route_table = RouteTable()
+
+# Decorator for registering routes; upload_types limits which content types multipart file parts may have
+def route(path_pattern, method="GET", upload_types=None, max_upload_size=None):
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
             return func(*args, **kwargs)
-        
-        # Define a function to replace the patterns
-        def replacer(match):
-            var_type, var_name = match.groups()
-            if var_type == 'int':
-                return r'(?P<{}>\d+)'.format(var_name)
-            elif var_type == 'string':
-                return r'(?P<{}>[^/]+)'.format(var_name)
-            else:
-                # Default to matching any non-slash characters
-                return r'(?P<{}>[^/]+)'.format(var_name)
-        
-        # Use re.sub with a function to handle replacements
-        pattern_re = re.compile(r'<(int|string):(\w+)>')
-        regex_pattern = '^' + pattern_re.sub(replacer, path_pattern) + '$'
-        pattern = re.compile(regex_pattern)
-        route_registry.append((pattern, method, func))
+
+        # Handlers declaring a headers parameter get the request headers, e.g. for conditional requests
+        func.wants_headers = 'headers' in inspect.signature(func).parameters
+        func.upload_types = upload_types
+        func.max_upload_size = max_upload_size or Config.MAX_UPLOAD_SIZE
+        route_table.add(method, path_pattern, func)
         return wrapper
     return decorator
 
+class PooledHTTPServer(http.server.HTTPServer):
+    """HTTP server running requests on a bounded pool of worker threads.
+
+    Connections waiting for their next request are parked in a selector rather than holding a worker, so idle
+    keep-alive connections never stall requests that are ready to run."""
+    allow_reuse_address = True
+
+    def __init__(self, server_address, handler_class, workers):
+        # Set up before binding, a failed bind calls server_close()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="http")
+        self._idle = selectors.DefaultSelector()
+        # Workers hand connections back through this queue, only the idle thread touches the selector
+        self._parked = queue.SimpleQueue()
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._idle.register(self._wakeup_reader, selectors.EVENT_READ)
+        self._closing = False
+        super().__init__(server_address, handler_class)
+        self._idle_thread = threading.Thread(target=self._watch_idle, name="http-idle", daemon=True)
+        self._idle_thread.start()
+
+    def process_request(self, request, client_address):
+        # Set up once per connection, then driven one request at a time instead of by the handler's own loop
+        handler = self.RequestHandlerClass.__new__(self.RequestHandlerClass)
+        handler.request, handler.client_address, handler.server = request, client_address, self
+        handler.close_connection = True
+        try:
+            handler.setup()
+        except Exception:
+            self.handle_error(request, client_address)
+            self.shutdown_request(request)
+            return
+        # Even a fresh connection only gets a worker once its request starts arriving
+        self._park(handler)
+
+    def _serve(self, handler):
+        try:
+            handler.handle_one_request()
+            while not handler.close_connection and self._has_buffered_request(handler):
+                handler.handle_one_request()
+        except Exception:
+            self.handle_error(handler.request, handler.client_address)
+            handler.close_connection = True
+        if handler.close_connection:
+            self._close(handler)
+        else:
+            self._park(handler)
+
+    def _has_buffered_request(self, handler):
+        # A pipelined request may already sit in the read buffer, where the selector can't see it
+        handler.connection.setblocking(False)
+        try:
+            return bool(handler.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            handler.connection.settimeout(handler.timeout)
+
+    def _park(self, handler):
+        self._parked.put(handler)
+        self._wakeup_writer.send(b'\0')
+
+    def _close(self, handler):
+        try:
+            handler.finish()
+        except Exception:
+            pass
+        self.shutdown_request(handler.request)
+
+    def _watch_idle(self):
+        # Parked connection -> monotonic time at which it is closed for being idle too long
+        deadlines = {}
+        while not self._closing:
+            timeout = max(min(deadlines.values()) - time.monotonic(), 0) if deadlines else None
+            for key, _ in self._idle.select(timeout):
+                if key.fileobj is self._wakeup_reader:
+                    self._wakeup_reader.recv(4096)
+                    continue
+                self._idle.unregister(key.fileobj)
+                del deadlines[key.data]
+                self._pool.submit(self._serve, key.data)
+
+            while True:
+                try:
+                    handler = self._parked.get_nowait()
+                except queue.Empty:
+                    break
+                self._idle.register(handler.connection, selectors.EVENT_READ, handler)
+                deadlines[handler] = time.monotonic() + Config.HTTP_KEEPALIVE_SECONDS
+
+            now = time.monotonic()
+            for handler, deadline in list(deadlines.items()):
+                if deadline <= now:
+                    self._idle.unregister(handler.connection)
+                    del deadlines[handler]
+                    self._close(handler)
+
+        for handler in deadlines:
+            self._close(handler)
+
+    def server_close(self):
+        super().server_close()
+        self._closing = True
+        self._wakeup_writer.send(b'\0')
+        self._pool.shutdown(wait=False)
+
 # Custom HTTP handler to process requests based on the route registry
 class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
+    # Persistent connections; every response carries a Content-Length so the client knows where it ends
+    protocol_version = "HTTP/1.1"
+    # A request that stops arriving half-way gives its worker back after this many seconds
+    timeout = Config.HTTP_REQUEST_TIMEOUT
+    # Headers and body go out in separate writes, which Nagle would hold back for the client's delayed ACK
+    disable_nagle_algorithm = True
+
     def _handle_response(self, response):
         """Helper function to handle responses."""
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Methods", "GET, POST, DELETE")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type")
-
-        # Handle dictionary response (send as JSON)
-        if not isinstance(response[0], str):
-            self.send_header("Content-type", "text/html")
-            self.end_headers()
-            self.wfile.write(response[0])
+        # (content, status, mime type, extra headers), everything after content optional
+        if isinstance(response, tuple):
+            content, status_code, *rest = response
+            mime_type = rest[0] if rest else 'application/json'
+            extra_headers = rest[1] if len(rest) > 1 else {}
+        else:
+            content, status_code, mime_type, extra_headers = response, 200, 'application/json', {}
 
+        if content is None:
+            body = b''
+        elif isinstance(content, str):
+            body = content.encode('utf-8')
+        elif isinstance(content, bytes):
+            body = content
         else:
-            self.send_header("Content-type", "application/json")
-            self.end_headers()
-            self.wfile.write(response[0].encode('utf-8'))
-            
+            # If content is a dictionary or list, serialize it to JSON
+            body = json.dumps(content).encode('utf-8')
 
-    def do_OPTIONS(self):
-        self.send_response(200, "OK")
+        self.send_response(status_code)
         self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Methods", "GET, POST, DELETE, OPTIONS")
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, DELETE")
         self.send_header("Access-Control-Allow-Headers", "Content-Type")
+        for name, value in extra_headers.items():
+            self.send_header(name, value)
+        # 304 and 204 responses never have a body
+        if status_code in (204, 304):
+            self.end_headers()
+            return
+        self.send_header("Content-Type", mime_type)
+        self.send_header("Content-Length", str(len(body)))
         self.end_headers()
-
+        self.wfile.write(body)
 
     def do_OPTIONS(self):
         self.send_response(200, "OK")
         self.send_header("Access-Control-Allow-Origin", "*")
         self.send_header("Access-Control-Allow-Methods", "GET, POST, DELETE, OPTIONS")
         self.send_header("Access-Control-Allow-Headers", "Content-Type")
+        self.send_header("Content-Length", "0")
         self.end_headers()
 
-
     def do_GET(self):
-        handler = None
-        params = {}
-        for pattern, method, func in route_registry:
-            if method == "GET":
-                match = pattern.match(self.path)
-                if match:
-                    handler = func
-                    params = match.groupdict()
-                    break
-        if handler:
-            self.send_response(200)
-            response = handler(**params)
-            self._handle_response(response)
-        else:
-            print("Handler Missing!")
+        handler, params = route_table.match("GET", self.path)
+        if not handler:
             self.send_error(404, "Not Found")
+            return
+        if handler.wants_headers:
+            params['headers'] = self.headers
+        try:
+            response = handler(**params)
+        except Exception as e:
+            self.send_error(500, f"Error processing request: {e}")
+            return
+        self._handle_response(response)
 
     def do_POST(self):
-        handler = None
-        params = {}
-
         # Find the matching handler based on the registered routes
-        for pattern, method, func in route_registry:
-            if method == "POST":
-                match = pattern.match(self.path)
-                if match:
-                    handler = func
-                    params = match.groupdict()
-                    break
-
-        if handler:
-            print("Handler Found")
-            content_type = self.headers.get('Content-Type', '')
-            # Handle CORS preflight requests
-            if self.headers.get('Origin'):
-                self.send_response(200)
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-                self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-                self.end_headers()
-                if self.command == 'OPTIONS':
-                    return
-
-            # Check if the content type is multipart/form-data for file uploads
-            if 'multipart/form-data' in content_type:
-                print("File Upload Detected")
-                form = cgi.FieldStorage(
-                    fp=self.rfile,
-                    headers=self.headers,
-                    environ={
-                        'REQUEST_METHOD': 'POST',
-                        'CONTENT_TYPE': content_type,
-                    }
-                )
-                try:
-                    #print("Form: ", form)
-                    print("Handler: ", handler)
-                    response = handler(form=form, **params)
-                except Exception as e:
-                    self.send_error(500, f"Error processing form data: {e}")
-                    return
-            else:
-                # Read the request body
-                content_length = int(self.headers.get('Content-Length', 0))
-                post_data = self.rfile.read(content_length) if content_length > 0 else None
-                try:
-                    response = handler(post_data=post_data, **params)
-                except Exception as e:
-                    self.send_error(500, f"Error processing POST data: {e}")
-                    return
-
-            # Handle the response from the handler
-            if isinstance(response, tuple):
-                # Unpack the response tuple
-                content, status_code, *rest = response
-                mime_type = rest[0] if rest else 'application/json'
-            else:
-                content = response
-                status_code = 200
-                mime_type = 'application/json'
-
-            self.send_response(status_code)
-            self.send_header('Content-Type', mime_type)
-            self.send_header('Access-Control-Allow-Origin', '*')  # Allow CORS
-            self.end_headers()
+        handler, params = route_table.match("POST", self.path)
+        if not handler:
+            self.send_error(404, "Not Found")
+            return
+        if handler.wants_headers:
+            params['headers'] = self.headers
 
-            if content:
-                if isinstance(content, str):
-                    self.wfile.write(content.encode('utf-8'))
-                elif isinstance(content, bytes):
-                    self.wfile.write(content)
-                else:
-                    # If content is a dictionary or list, serialize it to JSON
-                    self.wfile.write(json.dumps(content).encode('utf-8'))
+        content_type = self.headers.get('Content-Type', '')
+        # Check if the content type is multipart/form-data for file uploads
+        if 'multipart/form-data' in content_type:
+            os.makedirs(Config.SAVES_DIR, exist_ok=True)
+            try:
+                # Uploads are streamed into the saves directory so handlers can move them into place
+                form = parse_multipart(self.rfile, self.headers, Config.SAVES_DIR,
+                                       handler.upload_types, handler.max_upload_size)
+            except MultipartError as e:
+                # send_error closes the connection, the rest of the body is never read
+                self.send_error(e.status, str(e))
+                return
+            try:
+                response = handler(form=form, **params)
+            except Exception as e:
+                self.send_error(500, f"Error processing form data: {e}")
+                return
+            finally:
+                form.close()
         else:
-            self.send_error(404, "Not Found")
+            # Read the request body
+            content_length = int(self.headers.get('Content-Length', 0))
+            post_data = self.rfile.read(content_length) if content_length > 0 else None
+            try:
+                response = handler(post_data=post_data, **params)
+            except Exception as e:
+                self.send_error(500, f"Error processing POST data: {e}")
+                return
 
+        self._handle_response(response)
@@ -1,4 +1,5 @@
-SAVEFILE = 'jumbotron.json'
+SAVEFILE = 'jumbotron.jbt'
+LEGACY_SAVEFILE = 'jumbotron.json'
 
 def is_raspberry_pi_4():
     try:
@@ -12,151 +13,347 @@ def is_raspberry_pi_4():
         pass
     return False
 
-import json
+import ctypes
+import os
 import platform
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+from PIL import Image
 from utils.config import Config
+from utils.calibration import wire_time
+from utils.layout import build_index_map, build_led_order
+from utils import saveformat
+from utils.saveformat import array_to_matrix, matrix_to_array
 
 # If we are running on a Raspberry Pi 4, import the real library, otherwise import the mock library 
 # The mock library is used for testing on non-Raspberry Pi 4 devices, like us developers
 if is_raspberry_pi_4():
-    from rpi_ws281x import PixelStrip, Color
+    from rpi_ws281x import PixelStrip
+    import _rpi_ws281x as ws
     Config.LOGGER.info("Running on a Raspberry Pi 4 device. Using real library.")
+
+    def led_buffer(strip):
+        # Map the channel's C ws2811_led_t array so a whole frame can be copied in at once
+        address = int(ws.ws2811_channel_t_leds_get(strip._channel))
+        return np.ctypeslib.as_array((ctypes.c_uint32 * strip.numPixels()).from_address(address))
 else:
-    from utils.mock_rpi_ws281x import PixelStrip, Color
+    from utils.mock_rpi_ws281x import PixelStrip, led_buffer
     Config.LOGGER.warn("Running on a non-Raspberry Pi 4 device. Using mock library.")
 
-class Pixel:
-    def __init__(self, r=0, g=0, b=0, brightness=100):
-        self._r = r
-        self._g = g
-        self._b = b
-        self._brightness = brightness
+# Channel layout of the framebuffer: (rows, columns, [r, g, b, brightness])
+R, G, B, BRIGHTNESS = range(4)
+DEFAULT_BRIGHTNESS = 100
+
+def pixel_to_array(r, g, b, brightness):
+    """Clamp a single pixel's channels into the framebuffer's uint8 range."""
+    return np.clip((r, g, b, brightness), 0, 255).astype(np.uint8)
+
+class FrameSnapshot:
+    """Read-only copy of the framebuffer at one version, with a cache for anything derived from it."""
+    def __init__(self, version, pixels, timestamp):
+        pixels.flags.writeable = False
+        self.version = version
+        self.pixels = pixels
+        self.timestamp = timestamp
+        self._cache = {}
+        self._cache_lock = threading.RLock()
+
+    def cached(self, key, build):
+        # Build each derived form (matrix, encodings...) once per version, however many clients ask for it
+        try:
+            return self._cache[key]
+        except KeyError:
+            with self._cache_lock:
+                if key not in self._cache:
+                    self._cache[key] = build()
+                return self._cache[key]
+
+    def get_matrix(self):
+        return self.cached('matrix', lambda: array_to_matrix(self.pixels))
+
+    def derive(self, key, transform):
+        # A snapshot of transform(pixels) at the same version, built once per key and with caches of its own
+        return self.cached(('derived', key), lambda: FrameSnapshot(self.version, transform(self.pixels), self.timestamp))
+
+# Peripheral clocking out each usable GPIO pin. Every strip initialises its peripheral as a whole, so two outputs
+# on one peripheral, e.g. the two PWM channels on pins 18 and 13, would reset each other
+PERIPHERALS = {12: 'PWM', 18: 'PWM', 13: 'PWM', 19: 'PWM', 21: 'PCM', 10: 'SPI'}
 
-    def updatePixel(self, r, g, b, brightness):
-        self._r = r
-        self._g = g
-        self._b = b
-        self._brightness = brightness
+class StripOutput:
+    """One data line of the panel: a PixelStrip on its own pin and DMA channel driving LEDs [start, stop) of the chain."""
+    def __init__(self, start, count, pin, freq_hz=800000, dma=10, invert=False, brightness=255, channel=0):
+        self.start = start
+        self.stop = start + count
+        self.wire_time = wire_time(count, freq_hz)
+        self.strip = PixelStrip(count, pin, freq_hz, dma, invert, brightness, channel)
+        self.strip.begin()
+        try:
+            self.buffer = led_buffer(self.strip)
+        except Exception as e:
+            Config.LOGGER.warning("LED buffer of pin %d not accessible, falling back to per-pixel writes: %s", pin, str(e))
+            self.buffer = None
+
+    def write(self, indices, colors):
+        # indices are relative to the start of this output
+        if self.buffer is not None:
+            self.buffer[indices] = colors
+        else:
+            for index, color in zip(np.arange(self.stop - self.start)[indices].tolist(), colors.tolist()):
+                self.strip.setPixelColor(index, color)
 
 class Jumbotron:
-    def __init__(self, rows, columns, pin, freq_hz=800000, dma=10, invert=False, brightness=255, channel=0):
+    def __init__(self, rows, columns, pin, freq_hz=800000, dma=10, invert=False, brightness=255, channel=0,
+                 origin=Config.LAYOUT_ORIGIN, serpentine=Config.LAYOUT_SERPENTINE, rotation=Config.LAYOUT_ROTATION,
+                 outputs=None):
         self._rows = rows
         self._columns = columns
-        self._pixels = [[Pixel() for _ in range(self._columns)] for _ in range(self._rows)]
+        self._pixels = np.zeros((rows, columns, 4), dtype=np.uint8)
+        self._pixels[..., BRIGHTNESS] = DEFAULT_BRIGHTNESS
+
+        # Compile the wiring once: _index_map[row, column] is the LED index of that pixel and
+        # _led_order permutes a row-major frame into LED chain order
+        self._index_map = build_index_map(rows, columns, origin, serpentine, rotation)
+        self._led_order = build_led_order(self._index_map)
+
+        # Pixels touched since the last push, and the colour last written to each LED (in LED order)
+        self._dirty = np.ones((rows, columns), dtype=bool)
+        self._shown = np.zeros(rows * columns, dtype=np.uint32)
+
+        # Every change to the framebuffer bumps the version; snapshots are cached per version.
+        # _lock guards the framebuffer, _output_lock serialises pushes to the strips.
+        self._version = 0
+        self._version_time = time.time_ns()
+        self._snapshot = None
+        self._listeners = []
+        self._renderer = None
+        self._render_requested = threading.Event()
+        self._lock = threading.RLock()
+        self._output_lock = threading.Lock()
+
+        # ws281x specific setup: the LED chain is split into consecutive runs, one per output
+        if outputs is None:
+            outputs = [{"pin": pin, "dma": dma, "channel": channel, "count": rows * columns}]
+        if sum(output["count"] for output in outputs) != rows * columns:
+            raise ValueError(f"Outputs drive {sum(output['count'] for output in outputs)} LEDs, expected {rows * columns}")
+
+        peripherals = [PERIPHERALS.get(output["pin"]) for output in outputs]
+        for peripheral in set(peripherals) - {None}:
+            if peripherals.count(peripheral) > 1:
+                pins = [output["pin"] for output, used in zip(outputs, peripherals) if used == peripheral]
+                raise ValueError(f"Outputs on pins {pins} share the {peripheral} peripheral, "
+                                 f"give each output its own: PWM (pin 18), PCM (pin 21) or SPI (pin 10)")
 
-        # ws281x specific setup
-        self._strip = PixelStrip(rows * columns, pin, freq_hz, dma, invert, brightness, channel)
-        self._strip.begin()
+        self._outputs = []
+        start = 0
+        for output in outputs:
+            self._outputs.append(StripOutput(start, output["count"], output["pin"], freq_hz, output.get("dma", dma),
+                                             invert, brightness, output.get("channel", channel)))
+            start += output["count"]
 
-        # Try to load saved state
+        # Try to load saved state, the binary boot frame or else the legacy JSON one
         try:
-            with open(SAVEFILE, 'r') as f:
-                data = json.loads(f.read())
-                for row in range(self._rows):
-                    for column in range(self._columns):
-                        self._pixels[row][column].updatePixel(data[row][column]['r'],
-                                                              data[row][column]['g'],
-                                                              data[row][column]['b'],
-                                                              data[row][column]['brightness'])
+            self._pixels[...] = saveformat.read(SAVEFILE if os.path.exists(SAVEFILE) else LEGACY_SAVEFILE)['content']
         except Exception as e:
             print(f"Error loading saved data: {e}")
         
-        # Ensure LEDs reflect current state
-        self._update_strip()
+        # Ensure LEDs reflect current state, whatever the strip was showing before we started
+        self._update_strip(force=True)
 
-    def _update_strip(self):
-        for row in range(self._rows):
-            for column in range(self._columns):
-                pixel = self._pixels[row][column]
-                
-                # Map the row from top-left (React layout) to bottom-left (LED wiring)
-                mapped_row = self._rows - row - 1
+    def _scaled_colors(self, pixels):
+        # Scale every pixel by its own brightness (0-100%) and pack it the same way Color() does
+        scaled = pixels[..., :BRIGHTNESS].astype(np.uint32) * pixels[..., BRIGHTNESS:] // 100
+        np.minimum(scaled, 255, out=scaled)
+        return (scaled[..., R] << 16) | (scaled[..., G] << 8) | scaled[..., B]
 
-                # Adjusting the index based on the zig-zag layout
-                if mapped_row % 2 == 0:  # If it's an even row (0-indexed)
-                    index = (mapped_row * self._columns) + column
-                else:  # If it's an odd row (0-indexed)
-                    index = (mapped_row * self._columns) + (self._columns - column - 1)
+    def _changed(self, region):
+        # Call with _lock held, after writing region of the framebuffer
+        self._dirty[region] = True
+        self._version += 1
+        self._version_time = time.time_ns()
+        for listener in self._listeners:
+            listener(self._version)
 
-                brightness_factor = pixel._brightness / 100.0
-                self._strip.setPixelColor(index, Color(int(pixel._r * brightness_factor),
-                                                    int(pixel._g * brightness_factor),
-                                                    int(pixel._b * brightness_factor)))
+    def _update_strip(self, force=False):
+        with self._output_lock:
+            with self._lock:
+                indices, colors = self._collect_changes(force)
+            if indices is None:
+                return
 
-        self._strip.show()
+            if isinstance(indices, slice):
+                touched = self._outputs
+                for output in touched:
+                    output.write(slice(None), colors[output.start:output.stop])
+            else:
+                touched = []
+                for output in self._outputs:
+                    mine = (indices >= output.start) & (indices < output.stop)
+                    if mine.any():
+                        output.write(indices[mine] - output.start, colors[mine])
+                        touched.append(output)
 
+            # show() only waits for the previous transfer on its own strip, so the outputs clock out in parallel
+            for output in touched:
+                output.strip.show()
 
+    def _collect_changes(self, force):
+        # Returns the LED indices and packed colours to write, or (None, None) when the strip is up to date
+        if force or self._dirty.all():
+            # Whole frame: gather into LED order and copy it into the strip buffer in one go
+            indices = slice(None)
+            colors = self._scaled_colors(self._pixels).ravel()[self._led_order]
+            self._dirty.fill(False)
+            if not force and np.array_equal(colors, self._shown):
+                return None, None
+        else:
+            # Only rewrite LEDs whose colour actually changed since the last push
+            rows, columns = np.nonzero(self._dirty)
+            self._dirty.fill(False)
+            indices = self._index_map[rows, columns]
+            colors = self._scaled_colors(self._pixels[rows, columns])
+            changed = colors != self._shown[indices]
+            if not changed.any():
+                return None, None
+            indices, colors = indices[changed], colors[changed]
+
+        self._shown[indices] = colors
+        return indices, colors
+
+    def _render_loop(self):
+        while True:
+            self._render_requested.wait()
+            self._render_requested.clear()
+            started = time.monotonic()
+            self._update_strip()
+            # Requests made while this push was on the wire are coalesced into the next one, at most one per refresh tick
+            remaining = 1 / Config.UPDATES_PER_SECOND - (time.monotonic() - started)
+            if remaining > 0:
+                time.sleep(remaining)
+
+    def start_renderer(self):
+        """Push changes committed with request_push() from a background thread, at most once per refresh tick."""
+        if self._renderer is None:
+            self._renderer = threading.Thread(target=self._render_loop, name="jumbotron-render", daemon=True)
+            self._renderer.start()
+
+    def request_push(self):
+        """Schedule a push of pending changes without waiting for the strip; pushes inline when no renderer runs."""
+        if self._renderer is None:
+            self._update_strip()
+        else:
+            self._render_requested.set()
+
+    @contextmanager
+    def edit(self):
+        """Yield a writable copy of the framebuffer and commit it as one version when the block exits cleanly."""
+        with self._lock:
+            pixels = self._pixels.copy()
+            yield pixels
+            changed = (pixels != self._pixels).any(axis=-1)
+            if changed.any():
+                self._pixels[...] = pixels
+                self._changed(changed)
+        self.request_push()
+
+    def refresh(self):
+        """Re-send the whole framebuffer to the strip, even if nothing changed."""
+        self._update_strip(force=True)
+
+    def get_wire_time(self):
+        """Seconds one frame takes on the wire, the lower bound for the time between two pushes."""
+        return max(output.wire_time for output in self._outputs)
 
     def updatePixel(self, row, column, r, g, b, brightness):
-        self._pixels[row][column].updatePixel(r, g, b, brightness)
-        self._update_strip()
+        with self._lock:
+            self._pixels[row, column] = pixel_to_array(r, g, b, brightness)
+            self._changed(np.s_[row, column])
+        self.request_push()
 
     def updateRow(self, row, r, g, b, brightness):
-        for column in range(self._columns):
-            self._pixels[row][column].updatePixel(r, g, b, brightness)
-        self._update_strip()
+        with self._lock:
+            self._pixels[row, :] = pixel_to_array(r, g, b, brightness)
+            self._changed(np.s_[row, :])
+        self.request_push()
 
     def updateColumn(self, column, r, g, b, brightness):
-        for row in range(self._rows):
-            self._pixels[row][column].updatePixel(r, g, b, brightness)
-        self._update_strip()
+        with self._lock:
+            self._pixels[:, column] = pixel_to_array(r, g, b, brightness)
+            self._changed(np.s_[:, column])
+        self.request_push()
 
     def updateAll(self, r, g, b, brightness):
-        for row in range(self._rows):
-            for column in range(self._columns):
-                self._pixels[row][column].updatePixel(r, g, b, brightness)
-        self._update_strip()
+        with self._lock:
+            self._pixels[...] = pixel_to_array(r, g, b, brightness)
+            self._changed(Ellipsis)
+        self.request_push()
 
     def update_from_matrix_array(self, matrix):
-        for row in range(self._rows):
-            for column in range(self._columns):
-                self._pixels[row][column].updatePixel(matrix[row][column]['r'],
-                                                      matrix[row][column]['g'],
-                                                      matrix[row][column]['b'],
-                                                      matrix[row][column]['brightness'])
-        self._update_strip()
-        
+        # Accept either a (rows, columns, 4) array or the legacy list-of-dicts matrix
+        if not isinstance(matrix, np.ndarray):
+            matrix = matrix_to_array(matrix)
+        with self._lock:
+            self._pixels[...] = matrix
+            self._changed(Ellipsis)
+        self.request_push()
+
+    def get_array(self):
+        """Return a copy of the framebuffer as a (rows, columns, 4) uint8 array."""
+        return self.snapshot().pixels.copy()
+
+    def get_version(self):
+        return self._version
+
+    def add_listener(self, callback):
+        """Call callback(version) on the mutating thread every time a new version is committed; keep it cheap."""
+        self._listeners.append(callback)
+
+    def snapshot(self):
+        """Return the immutable FrameSnapshot of the current version, shared by every caller until the next change."""
+        with self._lock:
+            if self._snapshot is None or self._snapshot.version != self._version:
+                self._snapshot = FrameSnapshot(self._version, self._pixels.copy(), self._version_time)
+            return self._snapshot
 
     def get2DArrayRepresentation(self):
-        return [[{
-                'r': self._pixels[row][column]._r,
-                'g': self._pixels[row][column]._g,
-                'b': self._pixels[row][column]._b,
-                'brightness': self._pixels[row][column]._brightness
-            } for column in range(self._columns)] for row in range(self._rows)]
+        return array_to_matrix(self.snapshot().pixels)
     
     def updateBrightness(self, brightness):
         # Update all pixels to this new brightness
-        for row in range(self._rows):
-            for column in range(self._columns):
-                self._pixels[row][column]._brightness = brightness
-        self._update_strip()
+        with self._lock:
+            self._pixels[..., BRIGHTNESS] = min(max(brightness, 0), 255)
+            self._changed(Ellipsis)
+        self.request_push()
 
     def getBrightness(self):
         # Return the brightness of the first pixel
-        return self._pixels[0][0]._brightness
+        return int(self.snapshot().pixels[0, 0, BRIGHTNESS])
     
     def reset(self):
         self.updateAll(0, 0, 0, 255)
 
     def save_to_file(self):
-        with open(SAVEFILE, 'w') as f:
-            f.write(json.dumps(self.get2DArrayRepresentation()))
+        saveformat.write(SAVEFILE, {'type': 'image', 'content': self.get_array()})
 
     # Static Methods
-    def convert_image_to_matrix(image, brightness=40):
-        # Resize image to match Jumbotron resolution
-        image = image.resize((Config.COLUMNS, Config.ROWS))
-        
-        # Convert image to RGB
-        image = image.convert("RGB")
-
-        matrix = []
-        for row in range(Config.ROWS):
-            matrix_row = []
-            for column in range(Config.COLUMNS):
-                r, g, b = image.getpixel((column, row))
-                matrix_row.append({'r': r, 'g': g, 'b': b, 'brightness': brightness})  # Assuming full brightness
-            matrix.append(matrix_row)
-
-        return matrix
\ No newline at end of file
+    def convert_image_to_array(image, brightness=40, resample=None):
+        # Resample straight to the Jumbotron resolution with the configured filter (nearest, box, bilinear, hamming, bicubic, lanczos)
+        resample = Image.Resampling[(resample or Config.RESAMPLE_FILTER).upper()]
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        else:
+            # Lets the JPEG decoder scale down while decoding instead of producing the full-size image first
+            image.draft("RGB", (Config.COLUMNS, Config.ROWS))
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image = image.resize((Config.COLUMNS, Config.ROWS), resample)
+
+        array = np.empty((Config.ROWS, Config.COLUMNS, 4), dtype=np.uint8)
+        array[..., :BRIGHTNESS] = np.asarray(image)
+        array[..., BRIGHTNESS] = min(max(brightness, 0), 255)
+        return array
+
+    def convert_image_to_matrix(image, brightness=40, resample=None):
+        # Legacy list-of-dicts form, only needed where the matrix ends up in JSON
+        return array_to_matrix(Jumbotron.convert_image_to_array(image, brightness, resample))
\ No newline at end of file
@@ -0,0 +1,35 @@
+import numpy as np
+
+ORIGINS = ('top-left', 'top-right', 'bottom-left', 'bottom-right')
+ROTATIONS = (0, 90, 180, 270)
+
+def build_index_map(rows, columns, origin='bottom-left', serpentine=True, rotation=0):
+    """
+    Compile the panel wiring into a (rows, columns) array holding the LED index of every pixel.
+
+    origin is the corner of the panel where the data line enters, serpentine selects zig-zag
+    wiring (every other line runs backwards) over progressive wiring, and rotation turns the
+    image counter-clockwise in 90 degree steps relative to the wiring.
+    """
+    if origin not in ORIGINS:
+        raise ValueError(f"Unknown layout origin '{origin}', expected one of {ORIGINS}")
+    if rotation not in ROTATIONS:
+        raise ValueError(f"Unknown layout rotation {rotation}, expected one of {ROTATIONS}")
+
+    # Lay the chain out on the physical panel, which is turned on its side for 90/270 degrees
+    wired_rows, wired_columns = (columns, rows) if rotation in (90, 270) else (rows, columns)
+    index_map = np.arange(wired_rows * wired_columns, dtype=np.intp).reshape(wired_rows, wired_columns)
+    if serpentine:
+        index_map[1::2] = index_map[1::2, ::-1]
+
+    vertical, horizontal = origin.split('-')
+    if vertical == 'bottom':
+        index_map = index_map[::-1]
+    if horizontal == 'right':
+        index_map = index_map[:, ::-1]
+
+    return np.ascontiguousarray(np.rot90(index_map, k=rotation // 90))
+
+def build_led_order(index_map):
+    """Invert an index map so that colors.ravel()[led_order] is the frame in LED chain order."""
+    return np.argsort(index_map.ravel()).astype(np.intp)
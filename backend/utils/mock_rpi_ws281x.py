@@ -1,32 +1,54 @@
 # mock_rpi_ws281x.py
+import time
+from collections import deque
+import numpy as np
+from utils.calibration import wire_time
+
+# How many of the most recent frames sent to the mock strip are kept for inspection
+RECORDED_FRAMES = 300
 
 class PixelStrip:
-    def __init__(self, *args, **kwargs):
-        pass
+    def __init__(self, num=50, pin=18, freq_hz=800000, *args, **kwargs):
+        # Stand-in for the ws2811_led_t array the real library renders from
+        self._leds = np.zeros(num, dtype=np.uint32)
+        self._wire_time = wire_time(num, freq_hz)
+        self._busy_until = 0.0
+        # (monotonic timestamp, LED buffer) of every frame that went out on the wire
+        self.frames = deque(maxlen=RECORDED_FRAMES)
 
     def begin(self):
         pass
 
     def show(self):
-        pass
+        # Like ws2811_render: wait for the previous DMA transfer to drain, then start this one and return
+        now = time.monotonic()
+        if now < self._busy_until:
+            time.sleep(self._busy_until - now)
+            now = self._busy_until
+        self._busy_until = now + self._wire_time
+        self.frames.append((now, self._leds.copy()))
 
     def setPixelColor(self, n, color):
-        pass
+        self._leds[n] = color
 
     def setPixelColorRGB(self, n, red, green, blue, white=0):
-        pass
+        self._leds[n] = Color(red, green, blue, white)
 
     def setBrightness(self, brightness):
         pass
 
     def getPixels(self):
-        return [0] * 50  # Assuming 50 LEDs, change as needed
+        return self._leds.tolist()
 
     def numPixels(self):
-        return 50  # Assuming 50 LEDs, change as needed
+        return len(self._leds)
 
     def getPixelColor(self, n):
-        return 0
+        return int(self._leds[n])
 
 def Color(r, g, b, w=0):
-    return (r << 16) | (g << 8) | b | (w << 24)
\ No newline at end of file
+    return (r << 16) | (g << 8) | b | (w << 24)
+
+def led_buffer(strip):
+    # Writable view of the strip's LED buffer, mirroring the real library helper in utils/jumbotron.py
+    return strip._leds
@@ -0,0 +1,226 @@
+import io
+import os
+import secrets
+from email.message import Message
+from email.parser import BytesHeaderParser
+
+# Streaming multipart/form-data parser: file parts are written to a temporary file chunk by chunk as they
+# arrive instead of being held in memory, and the request is rejected before its body is read where possible.
+CHUNK_SIZE = 64 * 1024
+MAX_HEADER_SIZE = 16 * 1024
+MAX_FIELD_SIZE = 64 * 1024
+
+
+def _create_part_file(directory):
+    # Mode 0o666 less the umask, as open(..., 'wb') would give, so the file keeps normal permissions once moved into
+    # place; tempfile.mkstemp would make it readable by its owner only
+    while True:
+        path = os.path.join(directory, '.upload-%s.part' % secrets.token_hex(8))
+        try:
+            return os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666), path
+        except FileExistsError:
+            pass
+
+
+class MultipartError(ValueError):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class FormField:
+    """A plain (non-file) form field, kept in memory."""
+    def __init__(self, name):
+        self.name = name
+        self.filename = None
+        self._data = bytearray()
+
+    def write(self, data):
+        if len(self._data) + len(data) > MAX_FIELD_SIZE:
+            raise MultipartError(413, "Form field %s is larger than %d bytes" % (self.name, MAX_FIELD_SIZE))
+        self._data += data
+
+    def finish(self):
+        pass
+
+    @property
+    def value(self):
+        return self._data.decode('utf-8', errors='replace')
+
+    @property
+    def file(self):
+        return io.BytesIO(bytes(self._data))
+
+    def close(self):
+        pass
+
+
+class UploadedFile:
+    """A file part streamed to a temporary file; move it with os.replace(part.path, ...) to keep it."""
+    def __init__(self, name, filename, content_type, directory):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.size = 0
+        fd, self.path = _create_part_file(directory)
+        self._writer = os.fdopen(fd, 'wb')
+        self._file = None
+
+    def write(self, data):
+        self._writer.write(data)
+        self.size += len(data)
+
+    def finish(self):
+        self._writer.close()
+
+    @property
+    def file(self):
+        # Opened on first use, like the file attribute of cgi.FieldStorage
+        if self._file is None:
+            self._file = open(self.path, 'rb')
+        return self._file
+
+    @property
+    def value(self):
+        return self.file.read()
+
+    def close(self):
+        self._writer.close()
+        if self._file is not None:
+            self._file.close()
+        # Whatever the handler didn't move away is discarded
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class MultipartForm:
+    """The parts of a multipart/form-data body, indexed by field name like cgi.FieldStorage."""
+    def __init__(self):
+        self._parts = {}
+
+    def add(self, part):
+        if part.name in self._parts:
+            self._parts[part.name].close()
+        self._parts[part.name] = part
+
+    def __contains__(self, name):
+        return name in self._parts
+
+    def __getitem__(self, name):
+        return self._parts[name]
+
+    def getvalue(self, name, default=None):
+        return self._parts[name].value if name in self._parts else default
+
+    def close(self):
+        for part in self._parts.values():
+            part.close()
+
+
+def _header_param(value, header, param):
+    message = Message()
+    message[header] = value
+    return message.get_param(param, header=header)
+
+
+class _BodyReader:
+    def __init__(self, rfile, length):
+        self._rfile = rfile
+        self.remaining = length
+
+    def read(self):
+        if self.remaining <= 0:
+            raise MultipartError(400, "Multipart body ended before its closing boundary")
+        chunk = self._rfile.read(min(CHUNK_SIZE, self.remaining))
+        if not chunk:
+            raise MultipartError(400, "Connection closed during upload")
+        self.remaining -= len(chunk)
+        return chunk
+
+    def drain(self):
+        while self.remaining > 0:
+            self.read()
+
+
+def _stream_part(reader, buffer, delimiter, part):
+    # Write everything up to the next delimiter into part, returning what was read past it
+    while True:
+        index = buffer.find(delimiter)
+        if index >= 0:
+            part.write(buffer[:index])
+            return buffer[index + len(delimiter):]
+        # Hold back a possible partial delimiter at the end of the buffer
+        keep = len(delimiter) - 1
+        if len(buffer) > keep:
+            part.write(buffer[:-keep])
+            buffer = buffer[-keep:]
+        buffer += reader.read()
+
+
+def parse_multipart(rfile, headers, directory, allowed_types=None, max_size=None):
+    """Parse a multipart/form-data request body from rfile into a MultipartForm, streaming file parts into directory.
+
+    allowed_types is a tuple of content type prefixes file parts must match. Raises MultipartError with the HTTP status
+    to answer; the body is then only partially read.
+    """
+    boundary = _header_param(headers.get('Content-Type', ''), 'content-type', 'boundary')
+    if not boundary:
+        raise MultipartError(400, "multipart/form-data without a boundary")
+    try:
+        length = int(headers.get('Content-Length'))
+    except (TypeError, ValueError):
+        raise MultipartError(411, "Uploads need a Content-Length")
+    if max_size is not None and length > max_size:
+        raise MultipartError(413, "Upload of %d bytes is larger than the %d byte limit" % (length, max_size))
+
+    reader = _BodyReader(rfile, length)
+    delimiter = b'--' + boundary.encode('latin-1')
+    form = MultipartForm()
+    try:
+        # Skip the preamble up to the first boundary
+        buffer = b''
+        while delimiter not in buffer:
+            buffer = buffer[-len(delimiter):] + reader.read()
+        buffer = buffer[buffer.index(delimiter) + len(delimiter):]
+        # Every later boundary is preceded by the CRLF that ends the previous part
+        delimiter = b'\r\n' + delimiter
+
+        while True:
+            while len(buffer) < 2:
+                buffer += reader.read()
+            if buffer.startswith(b'--'):
+                break
+            if not buffer.startswith(b'\r\n'):
+                raise MultipartError(400, "Malformed multipart boundary")
+            buffer = buffer[2:]
+
+            while b'\r\n\r\n' not in buffer:
+                if len(buffer) > MAX_HEADER_SIZE:
+                    raise MultipartError(400, "Multipart part headers are too large")
+                buffer += reader.read()
+            end = buffer.index(b'\r\n\r\n')
+            part_headers = BytesHeaderParser().parsebytes(buffer[:end + 4])
+            buffer = buffer[end + 4:]
+
+            name = part_headers.get_param('name', header='content-disposition')
+            filename = part_headers.get_filename()
+            if filename is None:
+                part = FormField(name)
+            else:
+                content_type = part_headers.get_content_type()
+                # Checked before a single byte of the file is stored
+                if allowed_types and not content_type.startswith(tuple(allowed_types)):
+                    raise MultipartError(415, "Uploads of type %s are not accepted here" % content_type)
+                part = UploadedFile(name, filename, content_type, directory)
+            form.add(part)
+            buffer = _stream_part(reader, buffer, delimiter, part)
+            part.finish()
+
+        # Discard the epilogue so the connection can carry the next request
+        reader.drain()
+    except BaseException:
+        form.close()
+        raise
+    return form
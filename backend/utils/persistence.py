@@ -0,0 +1,55 @@
+import threading
+import time
+from utils import saveformat
+from utils.config import Config
+
+
+class PersistenceWorker:
+    """Writes the latest submitted state to disk from a background thread, at most once per interval."""
+    def __init__(self, path, interval=None):
+        self._path = path
+        self._interval = interval if interval is not None else Config.STATE_SAVE_INTERVAL
+        # Latest state not yet on disk: a save dict, or a callable building one at write time
+        self._pending = None
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._changed = threading.Event()
+        self._last_write = 0.0
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="state-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, state):
+        """Queue state for writing, replacing anything still pending; returns immediately."""
+        with self._pending_lock:
+            self._pending = state
+        self._changed.set()
+
+    def flush(self):
+        """Write whatever is pending right away, e.g. before shutting down."""
+        self._write_pending()
+
+    def _run(self):
+        while True:
+            self._changed.wait()
+            # Let a burst of changes settle into one write per interval
+            delay = self._last_write + self._interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._write_pending()
+
+    def _write_pending(self):
+        with self._write_lock:
+            with self._pending_lock:
+                state, self._pending = self._pending, None
+                self._changed.clear()
+            if state is None:
+                return
+            try:
+                saveformat.write(self._path, state() if callable(state) else state)
+            except Exception as e:
+                Config.LOGGER.error("Could not persist state to %s: %s", self._path, str(e))
+            self._last_write = time.monotonic()
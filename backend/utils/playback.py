@@ -0,0 +1,297 @@
+import queue
+import threading
+import time
+import cv2
+import numpy as np
+from utils.config import Config
+from utils.jumbotron import BRIGHTNESS
+from utils.videocache import get_video_cache
+
+# Weight of the newest sample in the smoothed per-stage timings
+TIMING_SMOOTHING = 0.1
+# How often blocked stages wake up to check whether playback was stopped
+POLL_SECONDS = 0.1
+# Frame rates reported above this are treated as bogus container metadata
+MAX_SOURCE_FPS = 240
+
+
+class Timeline:
+    """Presentation times of a looping video: container timestamps where usable, else frame count over frame rate."""
+    def __init__(self, fps):
+        self.frame_duration = 1 / fps if fps and 0 < fps <= MAX_SOURCE_FPS else 1 / Config.UPDATES_PER_SECOND
+        # Frames seen in the current loop
+        self.frames = 0
+        self._offset = 0.0
+        self._first = None
+        self._last = None
+
+    def next(self, timestamp):
+        """Presentation time in seconds since playback started of the next frame, given its container timestamp."""
+        if self._first is None:
+            self._first = timestamp or 0.0
+        pts = self._offset + (timestamp or 0.0)
+        # Missing or non-increasing timestamps (some containers report 0 throughout) advance by one frame instead
+        if self._last is not None and pts <= self._last:
+            pts = self._last + self.frame_duration
+        self._last = pts
+        self.frames += 1
+        return pts
+
+    def rewind(self):
+        # The next loop's first frame follows this loop's last frame one frame duration later
+        if self._last is not None:
+            self._offset = self._last + self.frame_duration - (self._first or 0.0)
+        self._first = None
+        self.frames = 0
+
+
+class VideoPlayer:
+    """Plays a video through a decode stage and an output stage, joined by a bounded ring of preallocated frames."""
+    def __init__(self, buffer_frames=None):
+        self._buffer_frames = buffer_frames or Config.PLAYBACK_BUFFER_FRAMES
+        self._control_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self.video_path = None
+        # Slots of the ring flow free -> decoder -> ready -> output -> free, so no frame is allocated while playing
+        self._buffers = None
+        self._free = None
+        self._ready = None
+        # Playback clock: monotonic time at which presentation time 0 is due, set by the output stage
+        self._clock_start = None
+        self._panel_interval = None
+        self._frame_duration = None
+        # Presentation time from which on the decoder needs the next frame, frames before it would never be shown
+        self._next_wanted = 0.0
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.frames_decoded = 0
+        # Frames passed over without decoding because the panel would never show them
+        self.frames_skipped = 0
+        self.frames_shown = 0
+        # Frames that reached the output stage too late to be shown on time
+        self.frames_dropped = 0
+        # Times the output stage found the ring empty, i.e. decoding couldn't keep up
+        self.underruns = 0
+        # Times the clock was restarted after a stall instead of dropping everything that followed it
+        self.resyncs = 0
+        self.decode_time = 0.0
+        self.output_time = 0.0
+        self.wait_time = 0.0
+        self.lag = 0.0
+
+    def play(self, video_path):
+        """Stop whatever is playing and start looping video_path."""
+        with self._control_lock:
+            self._stop_threads()
+            rows, columns = Config.MATRIX.get_array().shape[:2]
+            self._buffers = np.empty((self._buffer_frames, rows, columns, 3), dtype=np.uint8)
+            self._free = queue.Queue()
+            self._ready = queue.Queue()
+            for slot in range(self._buffer_frames):
+                self._free.put(slot)
+            self._reset_stats()
+            self.video_path = video_path
+            self._clock_start = None
+            self._next_wanted = 0.0
+            self._frame_duration = None
+            # Never ask for frames faster than the strip can clock them out
+            self._panel_interval = max(1 / Config.UPDATES_PER_SECOND, Config.MATRIX.get_wire_time())
+
+            self._stop.clear()
+            self._threads = [threading.Thread(target=self._decode, args=(video_path,), name="video-decode", daemon=True),
+                             threading.Thread(target=self._output, name="video-output", daemon=True)]
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self):
+        """Stop playback and wait for both stages to finish, so the caller owns the panel afterwards."""
+        with self._control_lock:
+            self._stop_threads()
+
+    def _stop_threads(self):
+        self._stop.set()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        self._threads = []
+        self.video_path = None
+
+    def is_playing(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def get_stats(self):
+        return {
+            "playing": self.is_playing(),
+            "video": self.video_path,
+            "source_fps": round(1 / self._frame_duration, 2) if self._frame_duration else None,
+            "buffer_frames": self._buffer_frames,
+            "queue_depth": self._ready.qsize() if self._ready is not None else 0,
+            "frames_decoded": self.frames_decoded,
+            "frames_skipped": self.frames_skipped,
+            "frames_shown": self.frames_shown,
+            "frames_dropped": self.frames_dropped,
+            "underruns": self.underruns,
+            "resyncs": self.resyncs,
+            "decode_ms": round(self.decode_time * 1000, 2),
+            "output_ms": round(self.output_time * 1000, 2),
+            "wait_ms": round(self.wait_time * 1000, 2),
+            "lag_ms": round(self.lag * 1000, 2),
+        }
+
+    def _take_free_slot(self):
+        # Blocks while the ring is full, which is what keeps the decoder at most buffer_frames ahead
+        while not self._stop.is_set():
+            try:
+                return self._free.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                pass
+        return None
+
+    def _skip(self, pts, timeline):
+        """True if the frame at pts would be superseded before it could be shown, so it needn't be decoded."""
+        target = self._next_wanted
+        clock_start = self._clock_start
+        if clock_start is not None:
+            playhead = time.monotonic() - clock_start
+            # Falling this far behind is a stall, which the output stage answers by restarting the clock
+            if playhead - pts < Config.PLAYBACK_RESYNC_SECONDS:
+                target = max(target, playhead)
+        if pts + timeline.frame_duration <= target:
+            self.frames_skipped += 1
+            return True
+        # When the panel refreshes slower than the source, the frames in between are never shown
+        self._next_wanted = pts + self._panel_interval
+        return False
+
+    def _publish(self, slot, pts, started):
+        self.decode_time += (time.monotonic() - started - self.decode_time) * TIMING_SMOOTHING
+        self.frames_decoded += 1
+        self._ready.put((slot, pts))
+
+    def _decode(self, video_path):
+        try:
+            cache = get_video_cache(video_path)
+            # Wait for the cache to either produce its first frame or give up, e.g. on a full disk
+            while not self._stop.is_set() and cache.available() == 0 and not cache.complete:
+                self._stop.wait(POLL_SECONDS)
+            if cache.available():
+                self._decode_cached(cache)
+            else:
+                Config.LOGGER.warning("No frame cache for %s, decoding it directly", video_path)
+                self._decode_capture(video_path)
+        except Exception as e:
+            Config.LOGGER.error("Error in video decode stage: %s", str(e))
+
+    def _decode_cached(self, cache):
+        # The cache already holds RGB frames at the panel resolution, decoding is a copy out of the mapped file
+        timeline = Timeline(cache.fps)
+        self._frame_duration = timeline.frame_duration
+        index = 0
+        while not self._stop.is_set():
+            if index >= cache.available():
+                if not cache.complete:
+                    # Playback caught up with the transcoder
+                    self._stop.wait(timeline.frame_duration)
+                    continue
+                index = 0
+                timeline.rewind()
+
+            pts = timeline.next(cache.timestamp(index))
+            index += 1
+            # Skipping a cached frame costs nothing, it is simply never copied
+            if self._skip(pts, timeline):
+                continue
+
+            slot = self._take_free_slot()
+            if slot is None:
+                return
+            started = time.monotonic()
+            np.copyto(self._buffers[slot], cache.frame(index - 1))
+            self._publish(slot, pts, started)
+
+    def _decode_capture(self, video_path):
+        capture = cv2.VideoCapture(video_path)
+        try:
+            if not capture.isOpened():
+                Config.LOGGER.warning("Could not open video")
+                return
+            timeline = Timeline(capture.get(cv2.CAP_PROP_FPS))
+            self._frame_duration = timeline.frame_duration
+            rows, columns = self._buffers.shape[1:3]
+            while not self._stop.is_set():
+                # grab() only advances the stream, frames are converted into pixels by retrieve() once they are wanted
+                if not capture.grab():
+                    if timeline.frames == 0:
+                        Config.LOGGER.warning("Could not read any frame from %s", video_path)
+                        return
+                    capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    timeline.rewind()
+                    continue
+                pts = timeline.next(capture.get(cv2.CAP_PROP_POS_MSEC) / 1000)
+                if self._skip(pts, timeline):
+                    continue
+
+                slot = self._take_free_slot()
+                if slot is None:
+                    return
+                started = time.monotonic()
+                success, frame = capture.retrieve()
+                if not success:
+                    self._free.put(slot)
+                    continue
+
+                # Scale and convert straight into the ring slot, no per-frame allocation
+                buffer = self._buffers[slot]
+                cv2.resize(frame, (columns, rows), dst=buffer, interpolation=cv2.INTER_AREA)
+                cv2.cvtColor(buffer, cv2.COLOR_BGR2RGB, dst=buffer)
+                self._publish(slot, pts, started)
+        finally:
+            capture.release()
+
+    def _output(self):
+        try:
+            jumbotron = Config.MATRIX
+            frame_array = np.empty(self._buffers.shape[1:3] + (4,), dtype=np.uint8)
+
+            while not self._stop.is_set():
+                try:
+                    slot, pts = self._ready.get_nowait()
+                except queue.Empty:
+                    if self._clock_start is not None:
+                        self.underruns += 1
+                    try:
+                        slot, pts = self._ready.get(timeout=POLL_SECONDS)
+                    except queue.Empty:
+                        continue
+
+                # Every frame is due at an absolute time on the monotonic clock, so sleep overshoot never accumulates
+                now = time.monotonic()
+                if self._clock_start is None or now - (self._clock_start + pts) > Config.PLAYBACK_RESYNC_SECONDS:
+                    if self._clock_start is not None:
+                        # After a stall, e.g. waiting on the transcoder, carry on from here rather than racing to catch up
+                        self.resyncs += 1
+                    self._clock_start = now - pts
+                due = self._clock_start + pts
+                if now < due:
+                    self.wait_time += (due - now - self.wait_time) * TIMING_SMOOTHING
+                    if self._stop.wait(due - now):
+                        return
+                elif now > due + max(self._panel_interval, self._frame_duration or 0):
+                    # Behind schedule: skip this frame rather than showing everything late
+                    self._free.put(slot)
+                    self.frames_dropped += 1
+                    continue
+
+                started = time.monotonic()
+                self.lag += (max(started - due, 0.0) - self.lag) * TIMING_SMOOTHING
+                # Keep the current brightness setting
+                frame_array[..., BRIGHTNESS] = jumbotron.getBrightness()
+                frame_array[..., :BRIGHTNESS] = self._buffers[slot]
+                self._free.put(slot)
+                jumbotron.update_from_matrix_array(frame_array)
+                self.output_time += (time.monotonic() - started - self.output_time) * TIMING_SMOOTHING
+                self.frames_shown += 1
+        except Exception as e:
+            Config.LOGGER.error("Error in video output stage: %s", str(e))
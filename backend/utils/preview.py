@@ -0,0 +1,189 @@
+import json
+import struct
+import time
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+from utils.config import Config
+
+# Binary preview messages start with a fixed little-endian header:
+# protocol version, message type, flags, brightness, width, height, timestamp (ns)
+PROTOCOL_VERSION = 1
+HEADER = struct.Struct('<BBBBHHQ')
+MESSAGE_KEYFRAME = 0
+# A delta carries only the pixels that changed since the previous frame the client received:
+# u16 run count, then per run u16 start pixel, u16 length and the run's RGB bytes (plus brightness if flagged)
+MESSAGE_DELTA = 1
+RUN_HEADER = struct.Struct('<HH')
+# Sent while the panel is idle so clients know the connection is alive: the header alone
+MESSAGE_HEARTBEAT = 2
+# Gaps of up to this many unchanged pixels are resent inside a run, which is cheaper than another run header
+RUN_MERGE_GAP = 1
+# Set when pixels differ in brightness: a width * height brightness plane follows the RGB bytes
+FLAG_BRIGHTNESS_PLANE = 0x01
+
+# Clients pick a format with the WebSocket subprotocol, or with ?format=binary|json on the URL
+DELTA_SUBPROTOCOL = 'jumbotron.delta.v1'
+BINARY_SUBPROTOCOL = 'jumbotron.binary.v1'
+JSON_SUBPROTOCOL = 'jumbotron.json'
+SUBPROTOCOLS = [DELTA_SUBPROTOCOL, BINARY_SUBPROTOCOL, JSON_SUBPROTOCOL]
+FORMAT_DELTA = 'delta'
+FORMAT_BINARY = 'binary'
+FORMAT_JSON = 'json'
+SCALES = (1, 2, 4)
+
+def negotiate_format(websocket, query):
+    """Return the preview format a freshly connected client asked for, JSON unless it opted into binary or delta."""
+    formats = {DELTA_SUBPROTOCOL: FORMAT_DELTA, BINARY_SUBPROTOCOL: FORMAT_BINARY, JSON_SUBPROTOCOL: FORMAT_JSON}
+    if websocket.subprotocol in formats:
+        return formats[websocket.subprotocol]
+    preview_format = query.get('format', [FORMAT_JSON])[0]
+    return preview_format if preview_format in formats.values() else FORMAT_JSON
+
+def negotiate_stream(websocket):
+    """
+    Build the PreviewStream a freshly connected client subscribed to. Besides the format, the URL query can ask for
+    scale=2|4 (downscaled by that factor), region=x,y,width,height (a crop of the panel) and fps=N (a rate cap).
+    """
+    query = parse_qs(urlparse(websocket.path or '').query)
+    scale = 1
+    region = None
+    max_fps = None
+    try:
+        if 'region' in query:
+            x, y, width, height = (int(value) for value in query['region'][0].split(','))
+            x, y = min(max(x, 0), Config.COLUMNS - 1), min(max(y, 0), Config.ROWS - 1)
+            region = (x, y, max(1, min(width, Config.COLUMNS - x)), max(1, min(height, Config.ROWS - y)))
+        if 'scale' in query:
+            if int(query['scale'][0]) not in SCALES:
+                raise ValueError(f"scale must be one of {SCALES}")
+            scale = int(query['scale'][0])
+        if 'fps' in query:
+            max_fps = max(float(query['fps'][0]), 0.1)
+    except ValueError as e:
+        Config.LOGGER.warning("Ignoring invalid preview subscription %s: %s", websocket.path, str(e))
+    return PreviewStream(negotiate_format(websocket, query), scale, region, max_fps)
+
+def _scale_region(pixels, scale, region):
+    if region is not None:
+        x, y, width, height = region
+        pixels = pixels[y:y + height, x:x + width]
+    # Never scale a region down to nothing
+    scale = min(scale, *pixels.shape[:2])
+    if scale > 1:
+        height, width = pixels.shape[0] // scale, pixels.shape[1] // scale
+        blocks = pixels[:height * scale, :width * scale].reshape(height, scale, width, scale, 4)
+        pixels = (blocks.mean(axis=(1, 3)) + 0.5).astype(np.uint8)
+    return np.ascontiguousarray(pixels)
+
+class PreviewStream:
+    """Encoder state for one client: the last frame it received and how long ago its last keyframe was."""
+    def __init__(self, preview_format, scale=1, region=None, max_fps=None):
+        self.format = preview_format
+        self.scale = scale
+        self.region = region
+        self.max_fps = max_fps
+        self._base = None
+        self._since_keyframe = 0
+
+    def view(self, snapshot):
+        # The variant of the frame this client subscribed to, produced once per frame for everyone sharing it
+        if self.scale == 1 and self.region is None:
+            return snapshot
+        return snapshot.derive(('view', self.scale, self.region), lambda pixels: _scale_region(pixels, self.scale, self.region))
+
+    def is_current(self, snapshot):
+        return self._base is not None and self._base.version == snapshot.version
+
+    def plan(self, snapshot):
+        # Key of the message this client needs next; clients with equal keys are sent the very same bytes
+        if self.format == FORMAT_JSON:
+            return (FORMAT_JSON, snapshot.version)
+        if self.format == FORMAT_DELTA and self._base is not None and self._since_keyframe < Config.PREVIEW_KEYFRAME_INTERVAL:
+            return (FORMAT_DELTA, snapshot.version, self._base.version)
+        return (FORMAT_BINARY, snapshot.version)
+
+    def encode(self, snapshot):
+        plan = self.plan(snapshot)
+        if plan[0] == FORMAT_JSON:
+            return encode_json(snapshot)
+        if plan[0] == FORMAT_DELTA:
+            message = encode_delta(self._base, snapshot)
+            if message is not None:
+                return message
+        return encode_binary(snapshot)
+
+    def acknowledge(self, snapshot, message):
+        # Called once a message has been handed to the socket; the stream is ordered, so it becomes the next delta base
+        self._base = snapshot
+        if isinstance(message, bytes) and message[1] == MESSAGE_HEARTBEAT:
+            return
+        if isinstance(message, bytes) and message[1] == MESSAGE_KEYFRAME:
+            self._since_keyframe = 0
+        self._since_keyframe += 1
+
+def encode_heartbeat(snapshot, preview_format):
+    """Keep-alive carrying only a timestamp, so idle clients can still show the link latency."""
+    if preview_format == FORMAT_JSON:
+        return '{"timestamp": %d}' % time.time_ns()
+    height, width = snapshot.pixels.shape[:2]
+    return HEADER.pack(PROTOCOL_VERSION, MESSAGE_HEARTBEAT, 0, 0, width, height, time.time_ns())
+
+def encode_json(snapshot):
+    """Full frame as the JSON preview message: {'data': [[{r, g, b, brightness}...]], 'timestamp'}."""
+    # The matrix is serialised once per version; only the send timestamp is filled in per message
+    data = snapshot.cached('json', lambda: json.dumps(snapshot.get_matrix()))
+    return '{"data": %s, "timestamp": %d}' % (data, time.time_ns())
+
+def _keyframe_body(pixels):
+    rgb = np.ascontiguousarray(pixels[..., :3])
+    brightness = pixels[..., 3]
+    if (brightness == brightness.flat[0]).all():
+        return 0, int(brightness.flat[0]), rgb.tobytes()
+    return FLAG_BRIGHTNESS_PLANE, int(brightness.flat[0]), rgb.tobytes() + brightness.tobytes()
+
+def encode_binary(snapshot):
+    """Full frame as a binary keyframe: header followed by packed row-major RGB bytes (about 9 KB for 64x48)."""
+    flags, brightness, body = snapshot.cached('binary', lambda: _keyframe_body(snapshot.pixels))
+    height, width = snapshot.pixels.shape[:2]
+    return HEADER.pack(PROTOCOL_VERSION, MESSAGE_KEYFRAME, flags, brightness, width, height, time.time_ns()) + body
+
+
+def _delta_runs(base, target):
+    # Changed pixels grouped into (start, stop) runs over the flattened frame
+    changed = np.flatnonzero((base != target).any(axis=-1).ravel())
+    if len(changed) == 0:
+        return np.empty((0, 2), dtype=np.intp)
+    breaks = np.flatnonzero(np.diff(changed) > RUN_MERGE_GAP + 1)
+    starts = np.concatenate(([changed[0]], changed[breaks + 1]))
+    stops = np.concatenate((changed[breaks], [changed[-1]])) + 1
+    return np.stack((starts, stops), axis=1)
+
+def _delta_body(base, snapshot):
+    target = snapshot.pixels
+    flags, brightness, keyframe = snapshot.cached('binary', lambda: _keyframe_body(target))
+    runs = _delta_runs(base.pixels, target)
+    bytes_per_pixel = 4 if flags & FLAG_BRIGHTNESS_PLANE else 3
+
+    # Fall back to a keyframe when the delta would not be smaller
+    size = 2 + len(runs) * RUN_HEADER.size + int((runs[:, 1] - runs[:, 0]).sum()) * bytes_per_pixel
+    if size >= len(keyframe):
+        return None
+
+    rgb = target[..., :3].reshape(-1, 3)
+    levels = target[..., 3].ravel()
+    parts = [struct.pack('<H', len(runs))]
+    for start, stop in runs.tolist():
+        parts.append(RUN_HEADER.pack(start, stop - start))
+        parts.append(rgb[start:stop].tobytes())
+        if bytes_per_pixel == 4:
+            parts.append(levels[start:stop].tobytes())
+    return flags, brightness, b''.join(parts)
+
+def encode_delta(base, snapshot):
+    """Changes from base to snapshot as a delta message, or None when a keyframe would be as small."""
+    delta = snapshot.cached(('delta', base.version), lambda: _delta_body(base, snapshot))
+    if delta is None:
+        return None
+    flags, brightness, body = delta
+    height, width = snapshot.pixels.shape[:2]
+    return HEADER.pack(PROTOCOL_VERSION, MESSAGE_DELTA, flags, brightness, width, height, time.time_ns()) + body
\ No newline at end of file
@@ -0,0 +1,145 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+import numpy as np
+
+# Binary container used for saves, the last state and the boot frame:
+#   header  magic, version, flags, rows, columns, metadata length, payload length (little-endian, 20 bytes)
+#   JSON metadata (the save's type and any other keys, e.g. the video path of a video save)
+#   payload, if FLAG_FRAME: the RGB plane (rows * columns * 3 bytes, row-major) then the brightness plane
+#   (rows * columns bytes), zlib compressed as a whole if FLAG_ZLIB
+# Files that don't start with the magic are read as the legacy JSON formats.
+MAGIC = b'JBTS'
+VERSION = 1
+HEADER = struct.Struct('<4sBBHHII')
+FLAG_FRAME = 0x01
+FLAG_ZLIB = 0x02
+
+
+class SaveFormatError(ValueError):
+    pass
+
+
+def matrix_to_array(matrix):
+    """Convert the legacy list-of-dicts matrix into a (rows, columns, 4) uint8 array."""
+    if isinstance(matrix, np.ndarray):
+        return matrix
+    values = np.array([[(pixel['r'], pixel['g'], pixel['b'], pixel['brightness']) for pixel in row] for row in matrix])
+    return np.clip(values, 0, 255).astype(np.uint8)
+
+def array_to_matrix(array):
+    """Convert a (rows, columns, 4) array back into the legacy list-of-dicts matrix."""
+    return [[{'r': r, 'g': g, 'b': b, 'brightness': brightness} for r, g, b, brightness in row] for row in array.tolist()]
+
+
+def dumps(save_data, compress=False):
+    """Encode a save dict ({'type': ..., 'content': ...}) into the binary container."""
+    content = save_data.get('content')
+    if save_data.get('type') == 'image' and content is not None:
+        frame = matrix_to_array(content)
+        metadata = {key: value for key, value in save_data.items() if key != 'content'}
+        rows, columns = frame.shape[:2]
+        payload = frame[..., :3].tobytes() + frame[..., 3].tobytes()
+        flags = FLAG_FRAME
+    else:
+        metadata = save_data
+        rows = columns = 0
+        payload = b''
+        flags = 0
+
+    if compress and payload:
+        payload = zlib.compress(payload)
+        flags |= FLAG_ZLIB
+    encoded_metadata = json.dumps(metadata).encode('utf-8')
+    return HEADER.pack(MAGIC, VERSION, flags, rows, columns, len(encoded_metadata), len(payload)) + encoded_metadata + payload
+
+
+def _loads_legacy(data):
+    try:
+        legacy = json.loads(bytes(data))
+    except ValueError as e:
+        raise SaveFormatError("Neither a binary save nor legacy JSON: %s" % e)
+    # The boot frame used to be a bare matrix, saves and state a dict around one
+    try:
+        if isinstance(legacy, list):
+            return {'type': 'image', 'content': matrix_to_array(legacy)}
+        if isinstance(legacy, dict) and legacy.get('type') == 'image' and legacy.get('content') is not None:
+            legacy['content'] = matrix_to_array(legacy['content'])
+    except (TypeError, KeyError, AttributeError, ValueError) as e:
+        raise SaveFormatError("Legacy JSON is not a matrix of pixels: %r" % e)
+    return legacy
+
+
+def loads(data):
+    """Decode a binary container (bytes, or an mmap) or legacy JSON into a save dict with an ndarray frame."""
+    if data[:len(MAGIC)] != MAGIC:
+        return _loads_legacy(data)
+    if len(data) < HEADER.size:
+        raise SaveFormatError("Truncated header")
+    _, version, flags, rows, columns, metadata_length, payload_length = HEADER.unpack_from(data)
+    if version > VERSION:
+        raise SaveFormatError("Save format version %d is newer than this build understands" % version)
+    if len(data) < HEADER.size + metadata_length + payload_length:
+        raise SaveFormatError("Truncated save")
+
+    offset = HEADER.size
+    try:
+        save_data = json.loads(bytes(data[offset:offset + metadata_length]))
+    except ValueError as e:
+        raise SaveFormatError("Unreadable metadata: %s" % e)
+    if not isinstance(save_data, dict):
+        raise SaveFormatError("Metadata is not a JSON object")
+    offset += metadata_length
+    if flags & FLAG_FRAME:
+        pixel_count = rows * columns
+        if flags & FLAG_ZLIB:
+            try:
+                source = zlib.decompress(data[offset:offset + payload_length])
+            except zlib.error as e:
+                raise SaveFormatError("Corrupt compressed frame: %s" % e)
+            source_offset, size = 0, len(source)
+        else:
+            source, source_offset, size = data, offset, payload_length
+        # Checked before any view of the data exists, a view kept alive by the exception would keep a mapped file open
+        if size != pixel_count * 4:
+            raise SaveFormatError("Frame planes hold %d bytes, expected %d" % (size, pixel_count * 4))
+        planes = np.frombuffer(source, dtype=np.uint8, count=size, offset=source_offset)
+        # Interleave the two planes into the framebuffer layout, the only copy made on load
+        frame = np.empty((rows, columns, 4), dtype=np.uint8)
+        frame[..., :3] = planes[:pixel_count * 3].reshape(rows, columns, 3)
+        frame[..., 3] = planes[pixel_count * 3:].reshape(rows, columns)
+        save_data['content'] = frame
+    return save_data
+
+
+def read(path, use_mmap=False):
+    """Read a save from path; with use_mmap the planes are copied straight out of the mapped file."""
+    with open(path, 'rb') as file:
+        if use_mmap and os.fstat(file.fileno()).st_size:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return loads(mapped)
+        return loads(file.read())
+
+
+def temporary_path_for(path):
+    """Name for a file to be renamed over path, unique per writer so concurrent writes never share one."""
+    return '%s.%d-%d.tmp' % (path, os.getpid(), threading.get_ident())
+
+
+def write(path, save_data, compress=False):
+    """Write a save atomically and durably: after a power cut the file holds the old or the new save, never a mix."""
+    temporary_path = temporary_path_for(path)
+    with open(temporary_path, 'wb') as file:
+        file.write(dumps(save_data, compress))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+    # The rename itself only survives a power cut once the directory entry is on disk
+    directory = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
@@ -0,0 +1,77 @@
+import os
+import cv2
+from email.utils import formatdate, parsedate_to_datetime
+from PIL import Image
+from utils.saveformat import matrix_to_array, temporary_path_for
+
+# Thumbnails are rendered once when content is saved and stored next to the save as <name>.thumb.png
+THUMBNAIL_SUFFIX = '.thumb.png'
+# Largest thumbnail edge for video saves, images keep the panel resolution
+VIDEO_THUMBNAIL_SIZE = (320, 240)
+
+
+class ThumbnailError(Exception):
+    pass
+
+
+def thumbnail_path(save_path):
+    return os.path.splitext(save_path)[0] + THUMBNAIL_SUFFIX
+
+
+def render_thumbnail(save_data):
+    """Render the PIL image shown for a save: the stored frame, or the first frame of a saved video."""
+    if save_data['type'] == 'image':
+        return Image.fromarray(matrix_to_array(save_data['content'])[..., :3])
+
+    if save_data['type'] == 'video':
+        video_path = save_data['content']
+        if not video_path or not os.path.exists(video_path):
+            raise ThumbnailError("Video file not found: %s" % video_path)
+        capture = cv2.VideoCapture(video_path)
+        success, frame = capture.read()
+        capture.release()
+        if not success:
+            raise ThumbnailError("Failed to capture frame from video: %s" % video_path)
+        image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        image.thumbnail(VIDEO_THUMBNAIL_SIZE)
+        return image
+
+    raise ThumbnailError("Unknown content type: %s" % save_data['type'])
+
+
+def write_thumbnail(save_path, save_data):
+    """Render and store the thumbnail of a save, replacing any previous one."""
+    path = thumbnail_path(save_path)
+    temporary_path = temporary_path_for(path)
+    render_thumbnail(save_data).save(temporary_path, 'PNG')
+    # Readers see either the old or the new thumbnail, never a half-written one
+    os.replace(temporary_path, path)
+    return path
+
+
+def remove_thumbnail(save_path):
+    try:
+        os.remove(thumbnail_path(save_path))
+    except FileNotFoundError:
+        pass
+
+
+def validators(path):
+    """Return the (ETag, Last-Modified) pair identifying the current version of a file."""
+    stat = os.stat(path)
+    return '"%x-%x"' % (stat.st_mtime_ns, stat.st_size), formatdate(stat.st_mtime, usegmt=True)
+
+
+def is_fresh(request_headers, etag, last_modified):
+    """True if a conditional request's cached copy still matches, so a 304 can be answered."""
+    if_none_match = request_headers.get('If-None-Match')
+    if if_none_match is not None:
+        # If-None-Match takes precedence over If-Modified-Since when both are sent
+        return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+    if_modified_since = request_headers.get('If-Modified-Since')
+    if if_modified_since is not None:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
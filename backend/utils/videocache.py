@@ -0,0 +1,169 @@
+import json
+import os
+import struct
+import threading
+import cv2
+import numpy as np
+from utils.config import Config
+
+# Each video is transcoded once into files in the hidden cache directory of the saves, named after the video:
+#   <video>.frames      raw row-major RGB frames at the panel resolution, back to back
+#   <video>.frames.idx  the presentation timestamp of every frame in seconds, little-endian float64
+#   <video>.frames.json written last: dimensions, source fps and the source file it was built from
+# Frames are appended before their timestamp, so every indexed frame is complete.
+FRAMES_SUFFIX = '.frames'
+INDEX_SUFFIX = '.frames.idx'
+META_SUFFIX = '.frames.json'
+TIMESTAMP = struct.Struct('<d')
+
+
+class VideoCache:
+    """Panel-resolution RGB frames of one video, built incrementally in the background and read memory-mapped."""
+    def __init__(self, video_path, rows=None, columns=None):
+        self.video_path = video_path
+        self.rows = rows or Config.ROWS
+        self.columns = columns or Config.COLUMNS
+        self.fps = None
+        self.complete = False
+        base_path = cache_base_path(video_path)
+        self._frames_path = base_path + FRAMES_SUFFIX
+        self._index_path = base_path + INDEX_SUFFIX
+        self._meta_path = base_path + META_SUFFIX
+        self._timestamps = []
+        self._lock = threading.Lock()
+        self._map = None
+        self._builder = None
+        self._cancelled = threading.Event()
+        # The version of the video this cache holds, taken before anything is read from it
+        self.signature = self._signature()
+
+        if not self._load():
+            # Unlinked rather than truncated, so a reader still mapping a previous cache keeps its frames
+            self._remove_files()
+            self._builder = threading.Thread(target=self._build, name="video-cache", daemon=True)
+            self._builder.start()
+
+    def _signature(self):
+        # Identifies the source file and target resolution the cache was built for, None if the video is gone
+        try:
+            stat = os.stat(self.video_path)
+        except OSError:
+            return None
+        return [stat.st_size, stat.st_mtime_ns, self.rows, self.columns]
+
+    def _remove_files(self):
+        for path in (self._meta_path, self._index_path, self._frames_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _load(self):
+        try:
+            with open(self._meta_path, 'r') as file:
+                meta = json.load(file)
+            if self.signature is None or meta['source'] != self.signature:
+                return False
+            timestamps = np.fromfile(self._index_path, dtype='<f8')
+            if os.path.getsize(self._frames_path) < len(timestamps) * self.rows * self.columns * 3:
+                return False
+        except (OSError, ValueError, KeyError):
+            return False
+        self._timestamps = timestamps.tolist()
+        self.fps = meta['fps']
+        self.complete = True
+        return True
+
+    def _build(self):
+        capture = cv2.VideoCapture(self.video_path)
+        try:
+            if not capture.isOpened():
+                Config.LOGGER.warning("Could not open video for caching: %s", self.video_path)
+                return
+            self.fps = capture.get(cv2.CAP_PROP_FPS) or None
+            os.makedirs(os.path.dirname(self._frames_path), exist_ok=True)
+            with open(self._frames_path, 'wb') as frames_file, open(self._index_path, 'wb') as index_file:
+                while not self._cancelled.is_set():
+                    success, frame = capture.read()
+                    if not success:
+                        break
+                    timestamp = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+                    # INTER_AREA averages every source pixel into the panel pixel it lands on
+                    small = cv2.resize(frame, (self.columns, self.rows), interpolation=cv2.INTER_AREA)
+                    frames_file.write(cv2.cvtColor(small, cv2.COLOR_BGR2RGB).tobytes())
+                    frames_file.flush()
+                    index_file.write(TIMESTAMP.pack(timestamp))
+                    index_file.flush()
+                    with self._lock:
+                        self._timestamps.append(timestamp)
+            if self._cancelled.is_set():
+                return
+
+            with open(self._meta_path + '.tmp', 'w') as file:
+                json.dump({"source": self.signature, "rows": self.rows, "columns": self.columns, "fps": self.fps,
+                           "frames": len(self._timestamps)}, file)
+            os.replace(self._meta_path + '.tmp', self._meta_path)
+            Config.LOGGER.info("Cached %d frames of %s", len(self._timestamps), self.video_path)
+        except Exception as e:
+            Config.LOGGER.error("Error caching video %s: %s", self.video_path, str(e))
+        finally:
+            capture.release()
+            self.complete = True
+
+    def available(self):
+        """Number of frames that can be read so far."""
+        return len(self._timestamps)
+
+    def timestamp(self, index):
+        return self._timestamps[index]
+
+    def frame(self, index):
+        """Return frame index (below available()) as a read-only (rows, columns, 3) view of the mapped cache."""
+        with self._lock:
+            if self._map is None or index >= len(self._map):
+                # The file grows while it is being built, map everything written so far
+                self._map = np.memmap(self._frames_path, dtype=np.uint8, mode='r',
+                                      shape=(len(self._timestamps), self.rows, self.columns, 3))
+            return self._map[index]
+
+    def is_stale(self):
+        """True once the video changed since this cache was started, even mid-build, or if a finished build failed."""
+        if self._signature() != self.signature:
+            return True
+        return self.complete and not os.path.exists(self._meta_path)
+
+    def cancel(self):
+        """Stop a build in progress and wait for it, e.g. before a new cache of the same video takes over its files."""
+        self._cancelled.set()
+        if self._builder is not None and self._builder is not threading.current_thread():
+            self._builder.join()
+
+
+def cache_base_path(video_path):
+    # Kept out of the saves directory itself, where the catalog would take the .json metadata for a save
+    return os.path.join(Config.SAVES_DIR, Config.VIDEO_CACHE_DIR, os.path.basename(video_path))
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_video_cache(video_path):
+    """Return the cache of a video, starting to build it in the background if it doesn't exist yet."""
+    with _caches_lock:
+        cache = _caches.get(video_path)
+        if cache is None or cache.is_stale():
+            if cache is not None:
+                cache.cancel()
+            cache = _caches[video_path] = VideoCache(video_path)
+        return cache
+
+def remove_video_cache(video_path):
+    with _caches_lock:
+        cache = _caches.pop(video_path, None)
+        if cache is not None:
+            cache.cancel()
+    for suffix in (FRAMES_SUFFIX, INDEX_SUFFIX, META_SUFFIX):
+        try:
+            os.remove(cache_base_path(video_path) + suffix)
+        except FileNotFoundError:
+            pass
@@ -1,6 +1,14 @@
 import { get, writable } from 'svelte/store';
 import { Pixel } from './Pixel';
 
+const DELTA_SUBPROTOCOL = 'jumbotron.delta.v1';
+const BINARY_SUBPROTOCOL = 'jumbotron.binary.v1';
+const JSON_SUBPROTOCOL = 'jumbotron.json';
+const BINARY_HEADER_SIZE = 16;
+const FLAG_BRIGHTNESS_PLANE = 0x01;
+const MESSAGE_DELTA = 1;
+const MESSAGE_HEARTBEAT = 2;
+
 export class Jumbotron {
     rows: number = 0;
     columns: number = 0;
@@ -12,6 +20,11 @@ export class Jumbotron {
     fps: number = 0;
 
     private socket: WebSocket | null = null;
+    // Last decoded binary frame, the base that delta messages are applied to
+    private previewPixels: Pixel[][] = [];
+    // Paint operations queued until the next animation frame, then sent over the WebSocket as one batch
+    private pendingOperations: any[] = [];
+    private flushScheduled: boolean = false;
     private updatesCounter: number = 0;
     private fpsTimer: number | undefined;
     
@@ -89,15 +102,22 @@ export class Jumbotron {
         }
 
         const wsUrl = `ws://${hostname}:${port + 1}/jumbotron`;
-        this.socket = new WebSocket(wsUrl);
+        // Prefer the delta-encoded binary preview, then plain binary keyframes, then JSON
+        this.previewPixels = [];
+        this.socket = new WebSocket(wsUrl, [DELTA_SUBPROTOCOL, BINARY_SUBPROTOCOL, JSON_SUBPROTOCOL]);
+        this.socket.binaryType = 'arraybuffer';
 
         this.socket.onopen = () => {
             console.log('WebSocket connected');
         };
 
         this.socket.onmessage = (event) => {
-            const response = JSON.parse(event.data);
-            this.handleWebSocketMessage(response);
+            const response = typeof event.data === 'string' ? JSON.parse(event.data) : this.decodeBinaryFrame(event.data);
+            if (response && response.error) {
+                console.error('Paint batch rejected:', response.error);
+            } else if (response) {
+                this.handleWebSocketMessage(response);
+            }
         };
 
         this.socket.onclose = () => {
@@ -109,7 +129,76 @@ export class Jumbotron {
         };
     }
 
-    handleWebSocketMessage(response: { data: Pixel[][], timestamp: number }) {
+    // Binary preview message: 16 byte header (version, type, flags, brightness, width, height, timestamp).
+    // A keyframe is followed by row-major RGB bytes and, if flagged, a per-pixel brightness plane.
+    // A delta holds runs of changed pixels relative to the previous message, a heartbeat only the header.
+    decodeBinaryFrame(buffer: ArrayBuffer) {
+        const view = new DataView(buffer);
+        const type = view.getUint8(1);
+        const flags = view.getUint8(2);
+        const brightness = view.getUint8(3);
+        const width = view.getUint16(4, true);
+        const height = view.getUint16(6, true);
+        const timestamp = Number(view.getBigUint64(8, true));
+        const bytes = new Uint8Array(buffer);
+
+        if (type === MESSAGE_HEARTBEAT) {
+            return { timestamp };
+        }
+
+        if (type === MESSAGE_DELTA) {
+            if (this.previewPixels.length !== height) {
+                return null;
+            }
+            // Copy only the rows a run touches so unchanged rows keep their identity
+            const data = this.previewPixels.slice();
+            const runCount = view.getUint16(BINARY_HEADER_SIZE, true);
+            let offset = BINARY_HEADER_SIZE + 2;
+            for (let run = 0; run < runCount; run++) {
+                const start = view.getUint16(offset, true);
+                const length = view.getUint16(offset + 2, true);
+                const rgbOffset = offset + 4;
+                const brightnessOffset = rgbOffset + length * 3;
+                for (let i = 0; i < length; i++) {
+                    const row = Math.floor((start + i) / width);
+                    const column = (start + i) % width;
+                    if (data[row] === this.previewPixels[row]) {
+                        data[row] = data[row].slice();
+                    }
+                    data[row][column] = new Pixel(bytes[rgbOffset + i * 3], bytes[rgbOffset + i * 3 + 1], bytes[rgbOffset + i * 3 + 2],
+                        flags & FLAG_BRIGHTNESS_PLANE ? bytes[brightnessOffset + i] : brightness, row, column);
+                }
+                offset = brightnessOffset + (flags & FLAG_BRIGHTNESS_PLANE ? length : 0);
+            }
+            this.previewPixels = data;
+            return { data, timestamp };
+        }
+
+        const rgbOffset = BINARY_HEADER_SIZE;
+        const brightnessOffset = rgbOffset + width * height * 3;
+        const data: Pixel[][] = [];
+        for (let row = 0; row < height; row++) {
+            data[row] = [];
+            for (let column = 0; column < width; column++) {
+                const index = row * width + column;
+                data[row][column] = new Pixel(bytes[rgbOffset + index * 3], bytes[rgbOffset + index * 3 + 1], bytes[rgbOffset + index * 3 + 2],
+                    flags & FLAG_BRIGHTNESS_PLANE ? bytes[brightnessOffset + index] : brightness, row, column);
+            }
+        }
+        this.previewPixels = data;
+        return { data, timestamp };
+    }
+
+    handleWebSocketMessage(response: { data?: Pixel[][], timestamp: number }) {
+        // Heartbeats arrive while the panel is idle and only refresh the latency readout
+        if (!response.data) {
+            this._state.set({
+                ...get(this._state),
+                latency: Math.abs((Date.now() - (response.timestamp / 1000000))),
+            } as Jumbotron);
+            return;
+        }
+
         this.updatesCounter++;
         // Fill in the row and column values for each pixel for easier access in other methods later
         response.data.forEach((row, rowIndex) => row.forEach((pixel, columnIndex) => {
@@ -153,31 +242,63 @@ export class Jumbotron {
         return json.brightness;
     }
 
+    // Queue a paint operation for the WebSocket paint channel; returns false when the socket is not open
+    private queueOperation(operation: any) {
+        if (!this.socket || this.socket.readyState !== WebSocket.OPEN) {
+            return false;
+        }
+        // Consecutive pixel paints (a finger drag) share one pixels operation
+        const last = this.pendingOperations[this.pendingOperations.length - 1];
+        if (operation.op === 'pixels' && last && last.op === 'pixels') {
+            last.pixels.push(...operation.pixels);
+        } else {
+            this.pendingOperations.push(operation);
+        }
+        if (!this.flushScheduled) {
+            this.flushScheduled = true;
+            requestAnimationFrame(() => this.flushOperations());
+        }
+        return true;
+    }
+
+    private flushOperations() {
+        this.flushScheduled = false;
+        if (this.pendingOperations.length && this.socket && this.socket.readyState === WebSocket.OPEN) {
+            this.socket.send(JSON.stringify({ ops: this.pendingOperations }));
+        }
+        this.pendingOperations = [];
+    }
+
     async eraseAll(pixel: Pixel) {
         this.updateAll(pixel, '#000000');
     }
     async erasePixel(pixel: Pixel) {
+        if (this.queueOperation({ op: 'pixels', pixels: [[pixel.row, pixel.column, 0, 0, 0, 255]] })) return;
         let data = get(this._state);
         fetch(`http://${data.hostname}:${data.port}/jumbotron/pixel/${pixel.row}/${pixel.column}/0/0/0/255`);
     }
     async updateAll(pixel: Pixel, color: string) {
         let data = get(this._state);
         let { r, g, b } = Pixel.hexToRgb(color);
+        if (this.queueOperation({ op: 'fill', r, g, b, brightness: pixel.brightness })) return;
         fetch(`http://${data.hostname}:${data.port}/jumbotron/all/${r}/${g}/${b}/${pixel.brightness}`);
     }
     async updateColumn(pixel: Pixel, color: string) {
         let data = get(this._state);
         let { r, g, b } = Pixel.hexToRgb(color);
+        if (this.queueOperation({ op: 'rect', row: 0, column: pixel.column, height: data.rows, width: 1, r, g, b, brightness: pixel.brightness })) return;
         fetch(`http://${data.hostname}:${data.port}/jumbotron/column/${pixel.column}/${r}/${g}/${b}/${pixel.brightness}`);
     }
     async updateRow(pixel: Pixel, color: string) {
         let data = get(this._state);
         let { r, g, b } = Pixel.hexToRgb(color);
+        if (this.queueOperation({ op: 'rect', row: pixel.row, column: 0, height: 1, width: data.columns, r, g, b, brightness: pixel.brightness })) return;
         fetch(`http://${data.hostname}:${data.port}/jumbotron/row/${pixel.row}/${r}/${g}/${b}/${pixel.brightness}`);
     }
     async updatePixel(pixel: Pixel, color: string) {
         let data = get(this._state);
         let { r, g, b } = Pixel.hexToRgb(color);
+        if (this.queueOperation({ op: 'pixels', pixels: [[pixel.row, pixel.column, r, g, b, pixel.brightness]] })) return;
         fetch(`http://${data.hostname}:${data.port}/jumbotron/pixel/${pixel.row}/${pixel.column}/${r}/${g}/${b}/${pixel.brightness}`);
     }
 